@@ -0,0 +1,140 @@
+"""
+Micro-benchmark of create_entity_pairs on synthetic entity-dense sentences (like list and table pages), comparing it
+with the previous implementation that scanned for punctuation token by token for every pair. Both implementations
+must return exactly the same pairs. Only spaCy itself is needed; no pipeline package is loaded.
+
+Usage (from the SpanBERT folder, next to ise.py): python3 benchmarks/bench_entity_pairs.py [sentences] [tokens]
+"""
+import gc
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
+from new_help_functions import create_entity_pairs, candidate_sentences, bert2spacy, spacy2bert
+
+ENTITIES_OF_INTEREST = ["PERSON", "ORGANIZATION", "LOCATION", "CITY"]
+LABELS = ["PERSON", "ORG", "GPE", "LOC", "DATE"]
+
+
+def create_entity_pairs_reference(sents_doc, entities_of_interest, window_size=40):
+    """
+    The previous implementation of create_entity_pairs, kept as the reference for correctness and speed
+    """
+    if entities_of_interest is not None:
+        entities_of_interest = {bert2spacy[b] for b in entities_of_interest}
+    ents = sents_doc.ents
+    length_doc = len(sents_doc)
+    entity_pairs = []
+    for i in range(len(ents)):
+        e1 = ents[i]
+        if entities_of_interest is not None and e1.label_ not in entities_of_interest:
+            continue
+
+        for j in range(1, len(ents) - i):
+            e2 = ents[i + j]
+            if entities_of_interest is not None and e2.label_ not in entities_of_interest:
+                continue
+            if e1.text.lower() == e2.text.lower():
+                continue
+
+            if (1 <= (e2.start - e1.end) <= window_size):
+
+                punc_token = False
+                start = e1.start - 1 - sents_doc.start
+                if start > 0:
+                    while not punc_token:
+                        punc_token = sents_doc[start].is_punct
+                        start -= 1
+                        if start < 0:
+                            break
+                    left_r = start + 2 if start > 0 else 0
+                else:
+                    left_r = 0
+
+                punc_token = False
+                start = e2.end - sents_doc.start
+                if start < length_doc:
+                    while not punc_token:
+                        punc_token = sents_doc[start].is_punct
+                        start += 1
+                        if start == length_doc:
+                            break
+                    right_r = start if start < length_doc else length_doc
+                else:
+                    right_r = length_doc
+
+                if (right_r - left_r) > window_size:
+                    continue
+
+                x = [token.text for token in sents_doc[left_r:right_r]]
+                gap = sents_doc.start + left_r
+                e1_info = (e1.text, spacy2bert[e1.label_], (e1.start - gap, e1.end - gap - 1))
+                e2_info = (e2.text, spacy2bert[e2.label_], (e2.start - gap, e2.end - gap - 1))
+                entity_pairs.append((x, e1_info, e2_info))
+    return entity_pairs
+
+
+def synthetic_doc(num_sentences, num_tokens, rng):
+    """
+    Build a Doc of num_sentences sentences of num_tokens tokens where about half of the tokens are entities and one
+    token in eight is punctuation
+    """
+    words, ents, sent_starts = [], [], []
+    for _ in range(num_sentences):
+        for t in range(num_tokens):
+            sent_starts.append(t == 0)
+            r = rng.random()
+            if t == num_tokens - 1:
+                words.append(".")
+                ents.append("O")
+            elif r < 0.12:
+                words.append(rng.choice([",", ";", "|"]))
+                ents.append("O")
+            elif r < 0.55:
+                label = rng.choice(LABELS)
+                words.append(f"{label.title()}{rng.randint(0, 30)}")
+                ents.append(f"B-{label}")
+            else:
+                words.append("word")
+                ents.append("O")
+    return Doc(Vocab(), words=words, ents=ents, sent_starts=sent_starts)
+
+
+def main(num_sentences=500, num_tokens=20):
+    doc = synthetic_doc(num_sentences, num_tokens, random.Random(0))
+    sentences = list(doc.sents)
+    # Pairs need both entities and the punctuation around them within the window; long sentences without enough
+    # punctuation yield none, and the timings would then only compare empty outputs
+    pairs = sum(len(create_entity_pairs(s, ENTITIES_OF_INTEREST)) for s in sentences)
+    print(f"{len(sentences)} sentences, {len(doc)} tokens, {len(doc.ents)} entities, {pairs} pairs")
+    assert pairs > 0, "the synthetic sentences yield no entity pair; use fewer tokens per sentence"
+    # Start the timed runs with the same garbage collector state as without the count
+    gc.collect()
+
+    def precomputed_ents():
+        # Entities bucketed per sentence in one pass, as extract_relations_spbt does through candidate_sentences
+        return [create_entity_pairs(sentence, ENTITIES_OF_INTEREST, ents=ents)
+                for sentence, _, ents in candidate_sentences(doc)]
+
+    timings = {}
+    outputs = {}
+    for name, func in [("reference", lambda: [create_entity_pairs_reference(s, ENTITIES_OF_INTEREST) for s in sentences]),
+                       ("precomputed", lambda: [create_entity_pairs(s, ENTITIES_OF_INTEREST) for s in sentences]),
+                       ("+ doc ents", precomputed_ents)]:
+        started = time.perf_counter()
+        outputs[name] = func()
+        timings[name] = time.perf_counter() - started
+        print(f"{name:<12} {timings[name] * 1000:10.1f} ms  {sum(map(len, outputs[name]))} pairs")
+
+    for name in ["precomputed", "+ doc ents"]:
+        assert outputs["reference"] == outputs[name], f"{name} returned different pairs"
+        print(f"{name:<12} identical pairs, speed-up x{timings['reference'] / timings[name]:.1f}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
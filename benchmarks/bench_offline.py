@@ -0,0 +1,244 @@
+"""
+End-to-end offline benchmark of iterative set expansion for the four relations of ISE.relation_map. Recorded Custom
+Search responses and saved page HTML (benchmarks/fixtures/offline) are served by a local stub HTTP server, and the
+-gpt3 method uses a deterministic fake OpenAI client with a fixed latency, so runs need neither network access nor
+API keys and are repeatable. The -spanbert method runs the real spaCy pipeline and SpanBERT classifier. Every
+(method, relation) setting runs in a fresh process so that its peak RSS is measured on its own.
+
+Queries that were not recorded (the queries built from extracted tuples) are answered with 10 of the saved pages of
+the relation whose seed query they extend, chosen by a hash of the query, so the expansion keeps finding new pages.
+--page-latency delays every search and page response of the stub server to stand for the network, and --prefetch runs
+the expansion with speculative prefetching of the next query.
+
+Usage (from the SpanBERT folder, next to ise.py):
+    python3 benchmarks/bench_offline.py [-spanbert|-gpt3] [k] [--latency=<seconds>] [--spacy-model=<name>]
+                                        [--page-latency=<seconds>] [--prefetch]
+    python3 benchmarks/bench_offline.py record <google api key> <google engine id> <r> <q>
+"""
+import functools
+import http.server
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import threading
+import time
+import zlib
+from contextlib import redirect_stdout
+from urllib.parse import urlparse, parse_qs, quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "offline")
+SEARCHES = os.path.join(FIXTURES, "searches.json")
+THRESHOLDS = {"-spanbert": 0.7, "-gpt3": 0}
+CAPITALIZED_PHRASE = re.compile(r"[A-Z][a-z]+(?: [A-Z][a-z]+)*")
+
+
+def search_items(index, query, base_url):
+    """
+    Build the 10 search results answering a query from the recorded index
+    :param index: the content of searches.json
+    :param query: the q parameter of the request
+    :param base_url: the URL of the stub server
+    :return: a list of Custom Search result items
+    """
+    recorded = index["queries"].get(query)
+    if recorded is None:
+        recorded = []
+        for relation in index["relations"].values():
+            if query.startswith(relation["seed"]):
+                pages = relation["pages"]
+                offset = zlib.crc32(query.encode("utf-8")) % len(pages)
+                recorded = [{"page": pages[(offset + i) % len(pages)], "title": "", "snippet": ""}
+                            for i in range(min(10, len(pages)))]
+    return [{"link": f"{base_url}/pages/{item['page']}", "title": item["title"], "snippet": item["snippet"]}
+            for item in recorded]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /customsearch/v1?q=... from the recorded index and /pages/<name> from the saved pages, each response delayed
+    by page_latency seconds
+    """
+
+    def __init__(self, index, page_latency, *args, **kwargs):
+        self.index = index
+        self.page_latency = page_latency
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        time.sleep(self.page_latency)
+        url = urlparse(self.path)
+        if url.path == "/customsearch/v1":
+            query = parse_qs(url.query).get("q", [""])[0]
+            base_url = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+            self.reply(json.dumps({"items": search_items(self.index, query, base_url)}).encode("utf-8"),
+                       "application/json")
+        elif url.path.startswith("/pages/") and "/" not in url.path[len("/pages/"):]:
+            path = os.path.join(FIXTURES, "pages", url.path[len("/pages/"):])
+            if not os.path.exists(path):
+                self.send_error(404)
+                return
+            self.reply(open(path, "rb").read(), "text/html")
+        else:
+            self.send_error(404)
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(page_latency=0.0):
+    """
+    Start the stub server on a free local port in a daemon thread
+    :param page_latency: the number of seconds every response is delayed
+    :return: the base URL of the server
+    """
+    index = json.load(open(SEARCHES, encoding="utf-8"))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(StubHandler, index, page_latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class FakeOpenAI:
+    """
+    Deterministic stand-in for the openai module: Completion.create waits latency seconds, then answers with the
+    first two capitalized phrases of the prompt sentence as subject and object of the requested relation
+    """
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.Completion = self
+
+    def create(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        relation = re.search(r"relationship type: (\S+)", prompt).group(1)
+        sentence = prompt[prompt.rfind("sentence: ") + len("sentence: "):prompt.rfind("  your answer")]
+        phrases = CAPITALIZED_PHRASE.findall(sentence)
+        answer = [[phrases[0], relation, phrases[1]]] if len(phrases) >= 2 else []
+        return {"choices": [{"text": json.dumps(answer)}]}
+
+
+def run_setting(method, relation, k, latency, spacy_model, base_url, prefetch, queue):
+    import ise
+    from gpt_engine import GPTEngine
+    from metrics import metrics
+
+    instance = ise.ISE()
+    if spacy_model:
+        instance.models.set_spacy_model(spacy_model)
+    index = json.load(open(SEARCHES, encoding="utf-8"))
+    instance.SEARCH_URL = base_url + "/customsearch/v1"
+    instance.GOOGLE_JSON_API_KEY = instance.GOOGLE_ENGINE_ID = "offline"
+    instance.METHOD = method
+    instance.RELATION = relation
+    instance.THRESHOLD = THRESHOLDS[method]
+    instance.QUERY = index["relations"][str(relation)]["seed"]
+    instance.k = k
+    fake_openai = FakeOpenAI(latency)
+    if method == "-gpt3":
+        instance.gpt_engine = GPTEngine(fake_openai, requests_per_minute=60000)
+    if prefetch:
+        instance.enable_prefetch()
+    metrics.enabled = True
+
+    started = time.perf_counter()
+    instance.models.warm_up(method)
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        instance.iterative_set_expansion()
+    seconds = time.perf_counter() - started
+    if instance.prefetcher is not None:
+        instance.prefetcher.close()
+
+    stage = "pairs" if method == "-spanbert" else "gpt"
+    model_calls = metrics.stages["spanbert"]["calls"] if method == "-spanbert" else fake_openai.calls
+    queue.put({"load": load_seconds, "seconds": seconds, "pages": len(instance.processed_URLs),
+               "sentences": metrics.stages[stage]["sentences"], "model_calls": model_calls,
+               "tuples": len(instance.X), "time_to_k": seconds if len(instance.X) >= k else None,
+               "peak_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def main(methods, k, latency, spacy_model, page_latency, prefetch):
+    base_url = start_stub_server(page_latency)
+    ctx = multiprocessing.get_context("spawn")
+    print(f"k = {k}, fake OpenAI latency = {latency} s, page latency = {page_latency} s, "
+          f"prefetch {'on' if prefetch else 'off'}")
+    print(f"{'method':<9} {'r':>2} {'load s':>7} {'pages':>6} {'pages/s':>8} {'sents/s':>8} {'model calls':>12} "
+          f"{'tuples':>7} {'time-to-k s':>12} {'peak RSS MiB':>13}")
+    for method in methods:
+        for relation in range(1, 5):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_setting, args=(method, relation, k, latency, spacy_model, base_url,
+                                                                         prefetch, queue))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                print(f"{method[1:]:<9} {relation:>2} failed (are the spaCy model and SpanBERT installed?)")
+                continue
+            r = queue.get()
+            time_to_k = f"{r['time_to_k']:12.2f}" if r["time_to_k"] is not None else f"{'not reached':>12}"
+            print(f"{method[1:]:<9} {relation:>2} {r['load']:7.2f} {r['pages']:6d} {r['pages'] / r['seconds']:8.2f} "
+                  f"{r['sentences'] / r['seconds']:8.1f} {r['model_calls']:12g} {r['tuples']:7d} {time_to_k} "
+                  f"{r['peak_kib'] / 1024:13.1f}")
+
+
+def record(api_key, engine_id, relation, query):
+    """
+    Save the live search results of a query and their pages to the fixtures, so that they can be replayed
+    """
+    from fetcher import PageFetcher
+
+    index = json.load(open(SEARCHES, encoding="utf-8"))
+    fetcher = PageFetcher()
+    response = fetcher.get("https://www.googleapis.com/customsearch/v1?key=" + api_key + "&cx=" + engine_id +
+                           "&q=" + quote(query))
+    items = []
+    for url, content, error in fetcher.fetch_all([item["link"] for item in response.json()["items"][:10]]):
+        if error is not None:
+            print(f"Unable to fetch {url} ({error}); it is recorded as an empty page")
+            content = b""
+        name = f"r{relation}_{zlib.crc32(url.encode('utf-8')):08x}.html"
+        open(os.path.join(FIXTURES, "pages", name), "wb").write(content)
+        items.append((url, name))
+    names = dict(items)
+    index["queries"][query] = [{"page": names[item["link"]], "title": item["title"], "snippet": item["snippet"]}
+                               for item in response.json()["items"][:10]]
+    pages = index["relations"].setdefault(str(relation), {"seed": query, "pages": []})["pages"]
+    pages.extend(name for _, name in items if name not in pages)
+    json.dump(index, open(SEARCHES, "w", encoding="utf-8"), indent=1)
+    fetcher.close()
+    print(f"Recorded {len(items)} pages for: {query}")
+
+
+if __name__ == "__main__":
+    inputs = [arg for arg in sys.argv if not arg.startswith("--")]
+    options = dict((arg[2:].split("=", 1) + [""])[:2] for arg in sys.argv if arg.startswith("--"))
+    if len(inputs) > 1 and inputs[1] == "record":
+        if len(inputs) < 6:
+            print("Please enter valid usage: python3 benchmarks/bench_offline.py record <google api key> "
+                  "<google engine id> <r> <q>")
+            sys.exit(1)
+        record(inputs[2], inputs[3], int(inputs[4]), inputs[5])
+        sys.exit(0)
+    if len(inputs) > 1 and inputs[1] not in THRESHOLDS:
+        print("Please enter valid usage: python3 benchmarks/bench_offline.py [-spanbert|-gpt3] [k] "
+              "[--latency=<seconds>] [--spacy-model=<name>] [--page-latency=<seconds>] [--prefetch]")
+        sys.exit(1)
+    main([inputs[1]] if len(inputs) > 1 else list(THRESHOLDS), int(inputs[2]) if len(inputs) > 2 else 10,
+         float(options.get("latency", 0.2)), options.get("spacy-model"), float(options.get("page-latency", 0)),
+         "prefetch" in options)
@@ -0,0 +1,61 @@
+"""
+Measure SpanBERT extraction throughput (pages/sec) of ExtractionPool for an increasing number of worker processes and
+check that every setting extracts the same relations. Model loading in the workers is not measured.
+
+Usage (from the SpanBERT folder, next to ise.py): python3 benchmarks/bench_parallel_extraction.py <text file> [...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from extraction_pool import ExtractionPool
+from model_registry import registry
+
+ENTITIES_OF_INTEREST = ["PERSON", "ORGANIZATION"]
+TARGET_RELATION = "per:employee_of"
+# entities of interest, target relation, method, threshold and relation name of every page
+JOB = (ENTITIES_OF_INTEREST, TARGET_RELATION, "-spanbert", 0.7, "Work_For")
+
+
+def merge(results):
+    """
+    Merge the relations of every page keeping the highest confidence, as ISE.add_tups_to_set does
+    """
+    merged = {}
+    for relations, *_ in results:
+        for tup, confidence in relations.items():
+            if tup not in merged or merged[tup] < confidence:
+                merged[tup] = confidence
+    return merged
+
+
+def main(paths):
+    texts = [open(path, encoding="utf-8").read()[:10000] for path in paths]
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({n for n in [1, 2, 4, 8, cores] if n <= cores})
+    print(f"{len(texts)} pages, {cores} cores")
+    print(f"{'workers':>8} {'seconds':>10} {'pages/sec':>10} {'speed-up':>10}")
+    baseline = None
+    for workers in worker_counts:
+        pool = ExtractionPool(workers, registry)
+        # All workers start together; waiting for a few small tasks lets them load their models before timing starts
+        for future in [pool.submit("Warm up.", *JOB) for _ in range(2 * workers)]:
+            future.result()
+        started = time.perf_counter()
+        futures = [pool.submit(text, *JOB) for text in texts]
+        relations = merge(future.result() for future in futures)
+        seconds = time.perf_counter() - started
+        pool.close()
+        if baseline is None:
+            baseline = (seconds, relations)
+        assert relations == baseline[1], f"{workers} workers extracted different relations"
+        print(f"{workers:8d} {seconds:10.2f} {len(texts) / seconds:10.2f} {baseline[0] / seconds:10.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Please enter valid usage: python3 benchmarks/bench_parallel_extraction.py <text file> [...]")
+        sys.exit(1)
+    main(sys.argv[1:])
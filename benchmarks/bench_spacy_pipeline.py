@@ -0,0 +1,67 @@
+"""
+Compare per-page spaCy annotation latency and peak memory for the full en_core_web_lg pipeline annotated page by page
+(as ise.py used to) against trimmed pipelines annotated with nlp.pipe, for several models, batch sizes and process
+counts. Every setting runs in a fresh process so that its peak RSS is measured on its own.
+
+Usage (from the SpanBERT folder, next to ise.py): python3 benchmarks/bench_spacy_pipeline.py <text file> [...]
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model_registry import ModelRegistry, SPACY_EXCLUDE
+
+# (name, spaCy model, excluded components, nlp.pipe batch size or None for one nlp() call per page, n_process)
+SETTINGS = [
+    ("lg full, per page", "en_core_web_lg", [], None, 1),
+    ("lg trimmed, per page", "en_core_web_lg", SPACY_EXCLUDE, None, 1),
+    ("lg trimmed, pipe 4", "en_core_web_lg", SPACY_EXCLUDE, 4, 1),
+    ("lg trimmed, pipe 10", "en_core_web_lg", SPACY_EXCLUDE, 10, 1),
+    ("lg trimmed, pipe 4 x2", "en_core_web_lg", SPACY_EXCLUDE, 4, 2),
+    ("sm trimmed, pipe 4", "en_core_web_sm", SPACY_EXCLUDE, 4, 1),
+]
+
+
+def run_setting(spacy_model, exclude, batch_size, n_process, texts, queue):
+    nlp = ModelRegistry(spacy_model=spacy_model, spacy_exclude=exclude).get_nlp()
+    # Warm-up so that lazy initialisation is not measured
+    nlp(texts[0])
+    started = time.perf_counter()
+    if batch_size is None:
+        num_sentences = sum(len(list(nlp(text).sents)) for text in texts)
+    else:
+        num_sentences = sum(len(list(doc.sents)) for doc in nlp.pipe(texts, batch_size=batch_size,
+                                                                       n_process=n_process))
+    seconds = time.perf_counter() - started
+    # ru_maxrss is in KiB on Linux
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    queue.put((seconds, num_sentences, peak_kib))
+
+
+def main(paths):
+    texts = [open(path, encoding="utf-8").read()[:10000] for path in paths]
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{len(texts)} pages")
+    print(f"{'setting':<24} {'ms/page':>10} {'sentences':>10} {'peak RSS MiB':>14}")
+    for name, spacy_model, exclude, batch_size, n_process in SETTINGS:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_setting, args=(spacy_model, exclude, batch_size, n_process, texts, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            print(f"{name:<24} failed (is {spacy_model} installed?)")
+            continue
+        seconds, num_sentences, peak_kib = queue.get()
+        print(f"{name:<24} {1000 * seconds / len(texts):10.1f} {num_sentences:10d} {peak_kib / 1024:14.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Please enter valid usage: python3 benchmarks/bench_spacy_pipeline.py <text file> [...]")
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+"""
+Compare SpanBERT throughput (sentences/sec) when predicting one sentence at a time, as ise.py used to, against the
+document-level batching of extract_relations_spbt for several batch sizes.
+
+Usage (from the SpanBERT folder, next to ise.py): python3 benchmarks/bench_spanbert_batching.py <text file> [...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from model_registry import registry
+from new_help_functions import create_spbt_examples, predict_batched
+
+ENTITIES_OF_INTEREST = ["PERSON", "ORGANIZATION"]
+BATCH_SIZES = [8, 16, 32, 64]
+
+
+def per_sentence(spanbert, sentence_examples):
+    for examples in sentence_examples:
+        spanbert.predict(examples)
+
+
+def batched(spanbert, sentence_examples, batch_size):
+    predict_batched(spanbert, [ex for examples in sentence_examples for ex in examples], batch_size)
+
+
+def report(name, seconds, num_sentences, num_examples):
+    print(f"{name:<20} {seconds:8.2f} s  {num_sentences / seconds:8.1f} sentences/sec  "
+          f"{num_examples / seconds:8.1f} examples/sec")
+
+
+def main(paths):
+    nlp = registry.get_nlp()
+    spanbert = registry.get_spanbert()
+    docs = [nlp(open(path, encoding="utf-8").read()[:10000]) for path in paths]
+    sentences = [sentence for doc in docs for sentence in doc.sents]
+    sentence_examples = [examples for examples in (create_spbt_examples(s, ENTITIES_OF_INTEREST) for s in sentences)
+                         if examples]
+    num_examples = sum(len(examples) for examples in sentence_examples)
+    print(f"{len(docs)} documents, {len(sentences)} sentences, {num_examples} SpanBERT examples")
+
+    # Warm-up run so that one-off allocations are not measured
+    batched(spanbert, sentence_examples[:4], 32)
+
+    started = time.perf_counter()
+    per_sentence(spanbert, sentence_examples)
+    report("per sentence", time.perf_counter() - started, len(sentences), num_examples)
+
+    for batch_size in BATCH_SIZES:
+        started = time.perf_counter()
+        batched(spanbert, sentence_examples, batch_size)
+        report(f"batch size {batch_size}", time.perf_counter() - started, len(sentences), num_examples)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Please enter valid usage: python3 benchmarks/bench_spanbert_batching.py <text file> [...]")
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+"""
+Simulate a long iterative set expansion in which every iteration adds new tuples, selects the next query tuple and
+finally prints the top tuples, comparing the previous dict scan (with its substring test against the growing query)
+and full sort against TupleStore. Both must select the same query tuples and return the same ranking.
+
+Usage (from the SpanBERT folder, next to ise.py): python3 benchmarks/bench_tuple_store.py [iterations] [tuples/iteration]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tuple_store import TupleStore
+
+
+def batches(iterations, per_iteration):
+    rng = random.Random(0)
+    return [[((f"Subject{rng.randint(0, 10 ** 6)}", "per:employee_of", f"Object{rng.randint(0, 10 ** 6)}"),
+              round(rng.random(), 3)) for _ in range(per_iteration)] for _ in range(iterations)]
+
+
+def run_dict(batches):
+    X, query, selected = {}, "seed query", []
+    for batch in batches:
+        for tup, confidence in batch:
+            if tup not in X or X[tup] < confidence:
+                X[tup] = confidence
+        selected_tup, max_confidence = None, -float('inf')
+        for tup, confidence in X.items():
+            if (tup[0] + " " + tup[2]) not in query and confidence > max_confidence:
+                max_confidence, selected_tup = confidence, tup
+        query = query + ' ' + selected_tup[0] + ' ' + selected_tup[2]
+        selected.append(selected_tup)
+    return selected, sorted(X.items(), key=lambda x: x[1], reverse=True)
+
+
+def run_store(batches):
+    X, selected = TupleStore(), []
+    for batch in batches:
+        for tup, confidence in batch:
+            X.upsert(tup, confidence)
+        selected.append(X.next_query_tuple())
+    return selected, list(X.top())
+
+
+def main(iterations=2000, per_iteration=50):
+    data = batches(iterations, per_iteration)
+    timings, outputs = {}, {}
+    for name, func in [("dict", run_dict), ("TupleStore", run_store)]:
+        started = time.perf_counter()
+        outputs[name] = func(data)
+        timings[name] = time.perf_counter() - started
+        print(f"{name:<12} {timings[name]:8.2f} s")
+    assert outputs["dict"] == outputs["TupleStore"], "TupleStore selected or ranked tuples differently"
+    print(f"identical selections and ranking, speed-up x{timings['dict'] / timings['TupleStore']:.1f}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,90 @@
+"""
+Check that the streaming HTML to text converter returns the same text as the previous BeautifulSoup implementation
+on the fixture pages in benchmarks/fixtures/pages (NAME.txt holds the expected text of NAME.html), when the page is
+fed in one piece and in small chunks, and compare the time and bytes read per page. The lxml backend is only timed
+and reported: libxml2 repairs malformed markup differently, so a few fixtures are expected to differ.
+
+Usage (from the SpanBERT folder, next to ise.py): python3 benchmarks/check_html_text.py [repeats]
+"""
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bs4 import BeautifulSoup
+from html_text import HTMLTextExtractor, etree
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+CHUNK_SIZES = [7, 1000, 64 * 1024, None]
+
+
+def clean_html_reference(content):
+    """
+    The previous BeautifulSoup implementation of ISE.clean_html
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    [s.extract() for s in soup(['style', 'script', '[document]', 'head', 'title'])]
+    txt = soup.getText().strip()
+    txt = re.sub(u'\xa0', ' ', txt)
+    txt = re.sub('\t+', ' ', txt)
+    txt = re.sub('\n+', ' ', txt)
+    txt = re.sub(' +', ' ', txt)
+    txt = txt.replace('​', '')
+    if len(txt) > 10000:
+        txt = txt[:10000]
+    return txt
+
+
+def stream(content, backend, chunk_size):
+    """
+    Feed content to an HTMLTextExtractor in chunks, stopping once it is done, as PageFetcher.fetch does
+    """
+    extractor = HTMLTextExtractor(backend=backend)
+    chunk_size = chunk_size or len(content) or 1
+    for i in range(0, len(content), chunk_size):
+        extractor.feed(content[i:i + chunk_size])
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor
+
+
+def timed(func, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return result, (time.perf_counter() - started) * 1000 / repeats
+
+
+def main(repeats=20):
+    backends = ["html.parser"] + (["lxml"] if etree is not None else [])
+    failures = 0
+    print(f"{'page':<20} {'bytes':>8} {'bs4 ms':>8} " + " ".join(f"{b + ' ms':>14} {'read':>8}" for b in backends))
+    for path in sorted(glob.glob(os.path.join(PAGES, "*.html"))):
+        name = os.path.basename(path)
+        content = open(path, "rb").read()
+        expected = open(path[:-len(".html")] + ".txt", encoding="utf-8", newline="").read()
+        reference, bs4_ms = timed(lambda: clean_html_reference(content), repeats)
+        if reference != expected:
+            print(f"{name}: the BeautifulSoup reference does not match {name[:-5]}.txt")
+            failures += 1
+        row = f"{name:<20} {len(content):8d} {bs4_ms:8.2f}"
+        for backend in backends:
+            differing = [chunk_size or len(content) for chunk_size in CHUNK_SIZES
+                         if stream(content, backend, chunk_size).text != expected]
+            if differing:
+                if backend == "html.parser":
+                    failures += len(differing)
+                print(f"{name}: {backend} text differs when fed in chunks of {differing} bytes")
+            extractor, ms = timed(lambda: stream(content, backend, 64 * 1024), repeats)
+            row += f" {ms:14.2f} {extractor.bytes_read:8d}"
+        print(row)
+    print("all html.parser outputs identical" if failures == 0 else f"{failures} mismatches")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main(*[int(arg) for arg in sys.argv[1:2]]) else 0)
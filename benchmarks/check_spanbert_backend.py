@@ -0,0 +1,151 @@
+"""
+Check the SpanBERT inference backends against the fp32 PyTorch model on the fixture examples in
+benchmarks/fixtures/spanbert_examples.json: the share of examples given the same relation label, and the drift of the
+confidence of the examples whose label agrees, must stay within TOLERANCES. Also reports the load time, the latency
+per example and the memory of each backend; every backend runs in a fresh process so that its memory is measured on
+its own. Exits with status 1 if a backend is out of tolerance.
+
+Usage (from the SpanBERT folder, next to ise.py):
+    python3 benchmarks/check_spanbert_backend.py [backend ...] [--batch-size=<n>] [--repeats=<n>]
+    python3 benchmarks/check_spanbert_backend.py record <text or html file> [...]
+"""
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from queue import Empty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "spanbert_examples.json")
+# backend -> (minimum label agreement, maximum mean confidence drift, maximum confidence drift) versus fp32
+TOLERANCES = {"int8": (0.97, 0.03, 0.15), "onnx": (0.999, 0.001, 0.005), "onnx-int8": (0.97, 0.03, 0.15)}
+# The distinct entity types of the four relations of ISE.relation_map
+ENTITIES_OF_INTEREST = [["PERSON", "ORGANIZATION"], ["PERSON", "LOCATION", "CITY", "STATE_OR_PROVINCE", "COUNTRY"],
+                        ["ORGANIZATION", "PERSON"]]
+
+
+def load_examples():
+    """
+    :return: the fixture examples, with the entity spans as tuples as create_spbt_examples builds them
+    """
+    examples = json.load(open(FIXTURE, encoding="utf-8"))
+    return [{"tokens": ex["tokens"], "subj": (ex["subj"][0], ex["subj"][1], tuple(ex["subj"][2])),
+             "obj": (ex["obj"][0], ex["obj"][1], tuple(ex["obj"][2]))} for ex in examples]
+
+
+def resident_kib():
+    """
+    :return: the current resident set size of the process in KiB
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def run_backend(backend, batch_size, repeats, queue):
+    from spanbert_backend import load_spanbert
+    from model_registry import SPANBERT_DIR
+    from new_help_functions import predict_batched
+
+    examples = load_examples()
+    before = resident_kib()
+    started = time.perf_counter()
+    spanbert = load_spanbert(SPANBERT_DIR, backend)
+    load_seconds = time.perf_counter() - started
+    predict_batched(spanbert, examples[:batch_size], batch_size)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        preds = predict_batched(spanbert, examples, batch_size)
+    seconds = (time.perf_counter() - started) / repeats
+    queue.put({"preds": [(label, float(confidence)) for label, confidence in preds], "load": load_seconds,
+               "ms": 1000 * seconds / len(examples), "model_mib": (resident_kib() - before) / 1024,
+               "peak_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+
+
+def main(backends, batch_size, repeats):
+    ctx = multiprocessing.get_context("spawn")
+    examples = load_examples()
+    print(f"{len(examples)} fixture examples, batch size {batch_size}")
+    print(f"{'backend':<10} {'load s':>7} {'ms/example':>11} {'speed-up':>9} {'model MiB':>10} {'peak MiB':>9} "
+          f"{'agreement':>10} {'mean drift':>11} {'max drift':>10}  check")
+    reference = None
+    failed = False
+    for backend in ["fp32"] + [b for b in backends if b != "fp32"]:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_backend, args=(backend, batch_size, repeats, queue))
+        proc.start()
+        result = None
+        while result is None and (proc.is_alive() or not queue.empty()):
+            try:
+                result = queue.get(timeout=1)
+            except Empty:
+                pass
+        proc.join()
+        if result is None or proc.exitcode != 0:
+            print(f"{backend:<10} failed (are torch, SpanBERT and, for onnx, onnxruntime installed?)")
+            failed = True
+            if reference is None:
+                break
+            continue
+        if reference is None:
+            reference = result
+        agreeing = [(a[1], b[1]) for a, b in zip(reference["preds"], result["preds"]) if a[0] == b[0]]
+        agreement = len(agreeing) / len(examples)
+        drifts = [abs(a - b) for a, b in agreeing] or [0.0]
+        mean_drift, max_drift = sum(drifts) / len(drifts), max(drifts)
+        check = ""
+        if backend in TOLERANCES:
+            min_agreement, max_mean_drift, max_max_drift = TOLERANCES[backend]
+            ok = agreement >= min_agreement and mean_drift <= max_mean_drift and max_drift <= max_max_drift
+            check = f"{'ok' if ok else 'FAILED'} (agreement >= {min_agreement}, mean drift <= {max_mean_drift}, " \
+                    f"max drift <= {max_max_drift})"
+            failed = failed or not ok
+        print(f"{backend:<10} {result['load']:7.2f} {result['ms']:11.3f} {reference['ms'] / result['ms']:9.2f} "
+              f"{result['model_mib']:10.1f} {result['peak_mib']:9.1f} {agreement:10.4f} {mean_drift:11.5f} "
+              f"{max_drift:10.5f}  {check}")
+    return not failed
+
+
+def record(paths):
+    """
+    Rebuild the fixture examples from text or HTML files with the installed spaCy model
+    """
+    from model_registry import registry
+    from html_text import html_to_text
+    from new_help_functions import candidate_sentences, create_spbt_examples
+
+    nlp = registry.get_nlp()
+    examples = []
+    for path in paths:
+        if path.endswith((".html", ".htm")):
+            text = html_to_text(open(path, "rb").read()).text
+        else:
+            text = open(path, encoding="utf-8").read()[:10000]
+        doc = nlp(text)
+        for entities_of_interest in ENTITIES_OF_INTEREST:
+            for sentence, _, ents in candidate_sentences(doc, entities_of_interest):
+                examples.extend(create_spbt_examples(sentence, entities_of_interest, ents))
+    unique = {json.dumps(ex, sort_keys=True): ex for ex in examples}
+    with open(FIXTURE, "w", encoding="utf-8") as f:
+        f.write("[\n" + ",\n".join(json.dumps(ex) for ex in unique.values()) + "\n]\n")
+    print(f"Recorded {len(unique)} examples from {len(paths)} files")
+
+
+if __name__ == "__main__":
+    inputs = [arg for arg in sys.argv if not arg.startswith("--")]
+    options = dict((arg[2:].split("=", 1) + [""])[:2] for arg in sys.argv if arg.startswith("--"))
+    if len(inputs) > 1 and inputs[1] == "record":
+        if len(inputs) < 3:
+            print("Please enter valid usage: python3 benchmarks/check_spanbert_backend.py record <text or html file> "
+                  "[...]")
+            sys.exit(1)
+        record(inputs[2:])
+        sys.exit(0)
+    backends = inputs[1:] or list(TOLERANCES)
+    if any(backend not in TOLERANCES and backend != "fp32" for backend in backends):
+        print("Please enter valid usage: python3 benchmarks/check_spanbert_backend.py [fp32|int8|onnx|onnx-int8 ...] "
+              "[--batch-size=<n>] [--repeats=<n>]")
+        sys.exit(1)
+    sys.exit(0 if main(backends, int(options.get("batch-size", 32)), int(options.get("repeats", 3))) else 1)
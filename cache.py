@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "./.ise_cache/cache.sqlite"
+# Entries older than this many seconds are treated as missing (one week)
+DEFAULT_TTL = 7 * 24 * 3600
+# Least recently used entries are evicted once the cache grows beyond this many bytes
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def content_key(*parts):
+    """
+    Build a content-addressed cache key from any number of strings
+    :param parts: the strings identifying the cached value
+    :return: the hex SHA-256 digest of the parts
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class Cache:
+    """
+    Persistent SQLite cache for Google search results, cleaned page text and extracted tuples. Values are stored as
+    JSON under (namespace, SHA-256 key), expire after ttl seconds and are evicted least-recently-used first once the
+    cache holds more than max_bytes. The file may be shared by several processes, e.g. the workers of an
+    ExtractionPool: the total size is kept in the database and every write runs in one exclusive transaction.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param path: the SQLite database file; its folder is created if needed
+        :param ttl: the number of seconds an entry stays valid
+        :param max_bytes: the maximum total size of the stored values
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, value TEXT, created REAL, "
+                          "accessed REAL, size INTEGER, PRIMARY KEY (namespace, key))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+        # Total size of the stored values, updated in the same transaction as the entries
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+        self.conn.execute("INSERT OR IGNORE INTO stats VALUES ('total_bytes', "
+                          "(SELECT COALESCE(SUM(size), 0) FROM entries))")
+        self.conn.commit()
+
+    @property
+    def total_bytes(self):
+        """
+        :return: the total size of the values stored by every process using the file
+        """
+        with self._lock:
+            return self.conn.execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+
+    def get(self, namespace, key):
+        """
+        Look up a cached value
+        :param namespace: the kind of value, e.g. "search", "page" or "extraction"
+        :param key: the key of the value within its namespace
+        :return: the stored value, or None if it is missing or expired
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT value, created FROM entries WHERE namespace = ? AND key = ?",
+                                    (namespace, key)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+            self.conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def contains(self, namespace, key):
+        """
+        Check whether a value is cached, without counting a hit or a miss or marking the entry as recently used
+        :param namespace: the kind of value, e.g. "search", "page" or "extraction"
+        :param key: the key of the value within its namespace
+        :return: True if the value is stored and not expired
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT created FROM entries WHERE namespace = ? AND key = ?",
+                                    (namespace, key)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl
+
+    def set(self, namespace, key, value):
+        """
+        Store a JSON-serializable value, dropping expired entries and evicting the least recently used ones if the
+        cache is over its size limit
+        :param namespace: the kind of value, e.g. "search", "page" or "extraction"
+        :param key: the key of the value within its namespace
+        :param value: the value to store
+        :return: void
+        """
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            # Taken before the first read, so that no other process writes between the size lookups and the updates
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self.conn.execute("SELECT size FROM entries WHERE namespace = ? AND key = ?",
+                                        (namespace, key)).fetchone()
+                self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                                  (namespace, key, data, now, now, len(data)))
+                self._add_bytes(len(data) - (old[0] if old else 0))
+                self._evict(now)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def _add_bytes(self, delta):
+        self.conn.execute("UPDATE stats SET value = value + ? WHERE name = 'total_bytes'", (delta,))
+
+    def _evict(self, now):
+        """
+        Drop expired entries, then the least recently used ones until the cache fits in max_bytes. Runs inside the
+        write transaction of set()
+        :param now: the current time
+        :return: void
+        """
+        expired = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE created < ?",
+                                    (now - self.ttl,)).fetchone()[0]
+        if expired:
+            self.conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+            self._add_bytes(-expired)
+        total = self.conn.execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for namespace, key, size in self.conn.execute("SELECT namespace, key, size FROM entries "
+                                                      "ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
+        self.conn.execute("UPDATE stats SET value = ? WHERE name = 'total_bytes'", (total,))
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+        :return: void
+        """
+        with self._lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("UPDATE stats SET value = 0 WHERE name = 'total_bytes'")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+
+    def close(self):
+        """
+        Close the underlying database connection
+        :return: void
+        """
+        self.conn.close()
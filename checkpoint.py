@@ -0,0 +1,88 @@
+import json
+import os
+
+DEFAULT_CHECKPOINT_PATH = "./.ise_cache/checkpoint.log"
+# Number of records appended after the last snapshot before the log is compacted
+DEFAULT_COMPACT_EVERY = 200
+
+
+class Checkpoint:
+    """
+    Append-only log of the state changes of an iterative set expansion run. Every change (a new iteration, a
+    processed page) is one JSON line appended and synced to disk, which costs one small write per page. The first
+    line is always a snapshot of the full state; once compact_every records follow it, the log is rewritten as a
+    single new snapshot in a temporary file that atomically replaces the log, so replaying it stays cheap. A partial
+    last line left by a crash is ignored, so the log always describes the state after the last complete record.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH, compact_every=DEFAULT_COMPACT_EVERY):
+        """
+        :param path: the log file; its folder is created if needed
+        :param compact_every: the number of records appended after a snapshot before compaction is due
+        """
+        self.path = path
+        self.compact_every = compact_every
+        self.pending = 0
+        self.file = None
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def load(self):
+        """
+        Read the records of the log, starting with its snapshot
+        :return: a list of record dicts; empty if there is no log
+        """
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        self.pending = max(0, len(records) - 1)
+        return records
+
+    def append(self, record):
+        """
+        Append one record and sync it to disk
+        :param record: a JSON-serializable dict
+        :return: void
+        """
+        if self.file is None:
+            self.file = open(self.path, "a+b")
+            # Drop a partial last line left by a crash
+            self.file.seek(0)
+            self.file.truncate(self.file.read().rfind(b"\n") + 1)
+        self.file.write((json.dumps(record) + "\n").encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending += 1
+
+    @property
+    def compaction_due(self):
+        return self.pending >= self.compact_every
+
+    def compact(self, snapshot):
+        """
+        Atomically replace the log with a single snapshot record
+        :param snapshot: a JSON-serializable dict holding the full state
+        :return: void
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.pending = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,166 @@
+import hashlib
+import re
+from collections import defaultdict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from metrics import metrics
+
+# Query parameters that only track where a click came from and never change the page. Parameters such as ref, amp or
+# outputType select a different page or rendering on many sites and are kept
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "igshid", "mc_cid", "mc_eid", "ref_src", "_ga",
+                   "_hsenc", "_hsmi"}
+# Host prefixes of mobile and AMP variants of a site
+HOST_PREFIXES = ("www.", "m.", "mobile.", "amp.")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Two pages whose fingerprints differ in at most this many of their 64 bits are near-duplicates
+DEFAULT_MAX_DISTANCE = 3
+SHINGLE_SIZE = 3
+WORD = re.compile(r"\w+")
+
+
+def canonical_url(url):
+    """
+    Reduce a URL to a key shared by its variants: http and https, www/mobile/AMP hosts and AMP paths, default ports,
+    tracking parameters, parameter order, trailing slashes and fragments are ignored. The key is only used to
+    recognize URLs already seen; pages are still downloaded from their original URL
+    :param url: a URL returned by the search
+    :return: the canonical form of the URL
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port is not None and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host += f":{port}"
+    path = re.sub(r"/+", "/", parts.path)
+    if path.startswith("/amp/"):
+        path = path[len("/amp"):]
+    path = re.sub(r"(/amp|\.amp)(?=/?$|\.html?$)", "", path).rstrip("/")
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name.lower() not in TRACKING_PARAMS and not name.lower().startswith("utm_"))
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def feature_hash(text):
+    """
+    :param text: a string
+    :return: a stable 64-bit hash of the string; unlike hash(), it is the same in every process
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def sentence_key(text, entities=()):
+    """
+    :param text: the text of a sentence
+    :param entities: the (start, end, label) of its candidate entities, with token positions relative to the sentence;
+    spaCy may find other entities in the same text on another page, and the sentence must then be extracted again
+    :return: a 64-bit key equal for sentences differing only in case and whitespace and having the same entities
+    """
+    return feature_hash(" ".join(text.lower().split()) + "\0" + repr(list(entities)))
+
+
+def simhash(text):
+    """
+    Compute the 64-bit SimHash fingerprint of a text from its word 3-shingles: similar texts get fingerprints that
+    differ in few bits
+    :param text: the plain text of a web page
+    :return: the fingerprint, or None if the text is too short to fingerprint
+    """
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return None
+    weights = [0] * 64
+    for i in range(len(words) - SHINGLE_SIZE + 1):
+        h = feature_hash(" ".join(words[i:i + SHINGLE_SIZE]))
+        for bit in range(64):
+            if h >> bit & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class SimHashIndex:
+    """
+    Compact in-memory index of page fingerprints answering "is there a fingerprint within max_distance bits?". Each
+    fingerprint is split into max_distance + 1 bands and filed under every band value; two fingerprints within
+    max_distance bits agree on at least one whole band, so only the fingerprints sharing a band are compared
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        :param max_distance: the maximum number of differing bits between near-duplicates
+        """
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = 64 // bands
+        # (shift, mask) of each band; the last band takes the remaining bits
+        self.bands = [(i * width, (1 << (width if i < bands - 1 else 64 - i * width)) - 1) for i in range(bands)]
+        # (band number, band value) -> list of (fingerprint, key) entries
+        self.buckets = defaultdict(list)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def find(self, fingerprint):
+        """
+        :param fingerprint: a 64-bit fingerprint
+        :return: the key of a stored fingerprint within max_distance bits, or None
+        """
+        for i, (shift, mask) in enumerate(self.bands):
+            for other, key in self.buckets.get((i, fingerprint >> shift & mask), ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, fingerprint, key):
+        """
+        :param fingerprint: a 64-bit fingerprint
+        :param key: the value returned by find() for near-duplicates of this fingerprint, e.g. a URL
+        :return: void
+        """
+        for i, (shift, mask) in enumerate(self.bands):
+            self.buckets[(i, fingerprint >> shift & mask)].append((fingerprint, key))
+        self.size += 1
+
+
+class DuplicateFilter:
+    """
+    Duplicate detection state of one expansion run: the fingerprints of the pages processed and the keys of the
+    sentences already run through the extraction model, with counters of what was skipped
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE):
+        """
+        :param max_distance: the maximum number of differing fingerprint bits between near-duplicate pages
+        """
+        self.index = SimHashIndex(max_distance)
+        self.sentences = set()
+        # "urls" skipped as already seen, near-duplicate "pages" and their "characters"
+        self.stats = defaultdict(int)
+
+    def near_duplicate(self, url, text):
+        """
+        Check a page against the pages seen so far, and add it to the index if it is new
+        :param url: the URL of the page
+        :param text: its plain text
+        :return: the URL of an earlier near-duplicate page, or None
+        """
+        with metrics.timer("dedup", url):
+            fingerprint = simhash(text)
+            if fingerprint is None:
+                return None
+            original = self.index.find(fingerprint)
+            if original is None:
+                self.index.add(fingerprint, url)
+                return None
+        self.stats["pages"] += 1
+        self.stats["characters"] += len(text)
+        metrics.add("dedup", "pages", 1, url)
+        return original
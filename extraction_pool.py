@@ -0,0 +1,209 @@
+import io
+import itertools
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from model_registry import ModelRegistry
+from gpt_engine import GPTEngine
+from metrics import metrics
+from cache import Cache
+from sentence_memo import SentenceMemo, memo_stats, DEFAULT_MAX_BYTES
+from new_help_functions import extract_relations_spbt, extract_relations_gpt, prefilter_stats
+import openai
+
+# State of a worker process, set once by init_worker
+_worker = {}
+
+
+def init_worker(settings):
+    """
+    Load the models of a worker process once, when the process starts
+    :param settings: the settings dict built by ExtractionPool
+    :return: void
+    """
+    _worker.update(settings)
+    metrics.enabled = settings["metrics"]
+    models = ModelRegistry(settings["spacy_model"], settings["spanbert_dir"], settings["spacy_exclude"],
+                           settings["spanbert_backend"])
+    for method in settings["methods"]:
+        models.warm_up(method)
+    _worker["models"] = models
+    # Every worker has its own memo of predictions, backed by the cache file shared with the parent when it is enabled
+    _worker["cache"] = Cache(settings["cache_path"], settings["cache_ttl"]) if settings["cache_path"] else None
+    _worker["memo"] = SentenceMemo(settings["memo_bytes"], _worker["cache"])
+    # One worker per core: keep torch from starting as many threads as there are cores in every worker
+    try:
+        import torch
+        torch.set_num_threads(settings["torch_threads"])
+    except ImportError:
+        pass
+
+
+def gpt_engine():
+    """
+    Return the GPTEngine of the worker process, creating it on the first GPT-3 page
+    :return: a GPTEngine
+    """
+    if "gpt_engine" not in _worker:
+        openai.api_key = _worker["openai_key"]
+        _worker["gpt_engine"] = GPTEngine(openai, max_workers=_worker["gpt_workers"],
+                                          requests_per_minute=_worker["gpt_rpm"],
+                                          sentences_per_prompt=_worker["gpt_pack"], cache=_worker["cache"],
+                                          memo_bytes=_worker["memo_bytes"])
+    return _worker["gpt_engine"]
+
+
+def shared_sentences(path):
+    """
+    Return the sentence keys published by ExtractionPool.share, reading the file only the first time
+    :param path: the path returned by ExtractionPool.share
+    :return: a frozenset of sentence keys
+    """
+    shared = _worker.setdefault("shared", {})
+    if path not in shared:
+        # Keep the snapshots of the few jobs running at the same time; older ones are not used any more
+        if len(shared) >= 8:
+            del shared[next(iter(shared))]
+        with open(path, "rb") as f:
+            shared[path] = pickle.load(f)
+    return shared[path]
+
+
+def extract_page(text, entities_of_interest, target_relation, method, threshold, relation_name, shared=None,
+                 seen_sentences=None):
+    """
+    Annotate one web page and extract its relations inside a worker process. Everything the extraction prints is
+    captured and returned so that the parent can print the log of every page in a deterministic order
+    :param text: the plain text of the web page
+    :param entities_of_interest: a list of entities of interest
+    :param target_relation: the target relation to filter the extracted relations
+    :param method: "-spanbert" or "-gpt3"
+    :param threshold: the extraction confidence threshold (SpanBERT only)
+    :param relation_name: the name of the relation used in GPT-3 prompts, e.g. "Work_For"
+    :param shared: the path returned by ExtractionPool.share for the sentences already processed by the job, which
+    are skipped; None to process every sentence
+    :param seen_sentences: the keys of other sentences to skip, e.g. those of earlier pages of the same iteration
+    :return: a (relations, sentences, log, stats, page_metrics, new_sentences) tuple; relations maps (subj, relation,
+    obj) to a confidence score, sentences maps it to the text of its sentence, log is the printed output, stats the
+    "prefilter" and "memo" counters of this page, page_metrics its per-stage metrics and new_sentences the keys of the
+    sentences processed for the first time
+    """
+    before = dict(prefilter_stats)
+    memo_before = dict(memo_stats)
+    metrics.reset()
+    seen = None
+    if shared is not None:
+        seen = set(shared_sentences(shared))
+        seen.update(seen_sentences or ())
+    sentences = {}
+    log = io.StringIO()
+    with redirect_stdout(log), metrics.timer("extract"):
+        with metrics.timer("spacy"):
+            doc = _worker["models"].get_nlp()(text)
+        if method == "-spanbert":
+            relations = extract_relations_spbt(doc, _worker["models"].get_spanbert(), entities_of_interest,
+                                               threshold, target_relation, _worker["batch_size"], sentences, seen,
+                                               _worker["memo"])
+        else:
+            relations = extract_relations_gpt(doc, openai, entities_of_interest, relation_name, gpt_engine(),
+                                              sentences, seen)
+    stats = {"prefilter": {name: count - before.get(name, 0) for name, count in prefilter_stats.items()},
+             "memo": {name: count - memo_before.get(name, 0) for name, count in memo_stats.items()}}
+    new_sentences = []
+    if seen is not None:
+        new_sentences = list(seen.difference(shared_sentences(shared), seen_sentences or ()))
+    return relations, sentences, log.getvalue(), stats, metrics.export(), new_sentences
+
+
+class ExtractionPool:
+    """
+    Runs spaCy annotation and relation extraction of whole web pages on a pool of worker processes, so that the pages
+    of an iteration are processed on several cores. Every worker loads its own spaCy pipeline and SpanBERT classifier
+    once at startup. Workers are started with the spawn method, as forking a process holding the fetcher threads and
+    torch is not safe. The method, threshold and relation are given per page, so one pool can serve several
+    extraction jobs at once.
+    """
+
+    def __init__(self, workers, models, methods=("-spanbert",), batch_size=32, openai_key="", gpt_workers=4,
+                 gpt_rpm=None, gpt_pack=1, memo_bytes=DEFAULT_MAX_BYTES, cache=None):
+        """
+        :param workers: the number of worker processes
+        :param models: the ModelRegistry whose spaCy model, excluded components, SpanBERT folder and backend the
+        workers use
+        :param methods: the methods whose models are loaded when a worker starts; others are loaded on first use
+        :param batch_size: the SpanBERT batch size
+        :param openai_key: the OpenAI secret key (GPT-3 only)
+        :param gpt_workers: the number of OpenAI requests in flight in each worker
+        :param gpt_rpm: the OpenAI request rate allowed for the whole pool, shared evenly between the workers, or None
+        for no limit
+        :param gpt_pack: the number of sentences packed into one GPT-3 prompt
+        :param memo_bytes: the approximate memory budget of the memo of predictions of each worker
+        :param cache: the Cache of the parent, whose file the workers also use to persist predictions, or None
+        """
+        self.workers = workers
+        self.settings = {"methods": list(methods), "spacy_model": models.spacy_model,
+                         "spacy_exclude": models.spacy_exclude, "spanbert_dir": models.spanbert_dir,
+                         "spanbert_backend": models.spanbert_backend, "batch_size": batch_size, "openai_key": openai_key,
+                         "gpt_workers": gpt_workers, "gpt_rpm": gpt_rpm / workers if gpt_rpm else None,
+                         "gpt_pack": gpt_pack,
+                         "torch_threads": max(1, (os.cpu_count() or 1) // workers), "memo_bytes": memo_bytes,
+                         "cache_path": cache.path if cache is not None else None,
+                         "cache_ttl": cache.ttl if cache is not None else None,
+                         "metrics": metrics.enabled}
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_worker, initargs=(self.settings,))
+        # Snapshots of the sentences processed by each job, written by share() and read once by every worker
+        self.shared_dir = tempfile.mkdtemp(prefix="ise-pool-")
+        self.shared_ids = itertools.count()
+
+    def share(self, sentences):
+        """
+        Publish the keys of the sentences already processed by a job, e.g. once per iteration, so that every worker
+        reads them once instead of receiving them with every page
+        :param sentences: an iterable of sentence keys
+        :return: the path to give to submit()
+        """
+        path = os.path.join(self.shared_dir, f"{next(self.shared_ids)}.pickle")
+        with open(path, "wb") as f:
+            pickle.dump(frozenset(sentences), f, pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def unshare(self, path):
+        """
+        Remove a file written by share() once no page uses it any more
+        :param path: the path returned by share()
+        :return: void
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def submit(self, text, entities_of_interest, target_relation, method, threshold, relation_name, shared=None,
+               seen_sentences=None):
+        """
+        Queue one web page for extraction
+        :param text: the plain text of the web page
+        :param entities_of_interest: a list of entities of interest
+        :param target_relation: the target relation to filter the extracted relations
+        :param method: "-spanbert" or "-gpt3"
+        :param threshold: the extraction confidence threshold (SpanBERT only)
+        :param relation_name: the name of the relation used in GPT-3 prompts, e.g. "Work_For"
+        :param shared: the path returned by share() for the sentences already processed, or None
+        :param seen_sentences: a list of the keys of other sentences to skip, or None
+        :return: a Future whose result is the tuple returned by extract_page
+        """
+        return self.executor.submit(extract_page, text, entities_of_interest, target_relation, method, threshold,
+                                    relation_name, shared, seen_sentences)
+
+    def close(self):
+        """
+        Stop the worker processes; pages still queued, e.g. when the run is interrupted, are dropped
+        :return: void
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self.shared_dir, ignore_errors=True)
@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+# (connect, read) timeouts in seconds for every page request
+DEFAULT_TIMEOUT = (5, 15)
+# Pages larger than this are cut off; only the first 10,000 characters of text are kept anyway
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class PageFetcher:
+    """
+    Downloads the web pages of one iteration concurrently with a bounded thread pool. A single requests Session is
+    shared by all workers so that connections to the same host are pooled and reused across pages and iterations.
+    """
+
+    def __init__(self, max_workers=10, timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES, pool_maxsize=4,
+                 deadline=30):
+        """
+        :param max_workers: the number of pages downloaded in parallel
+        :param timeout: a (connect, read) tuple of socket timeouts in seconds
+        :param max_bytes: the maximum number of bytes read from one response body
+        :param pool_maxsize: the number of connections kept alive per host
+        :param deadline: the maximum total number of seconds spent on one page
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, url, **kwargs):
+        """
+        Issue a plain GET request through the pooled session with the default timeout
+        :param url: the URL to request
+        :return: a requests Response object
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def fetch(self, url, sink=None):
+        """
+        Download the body of a web page, reading at most max_bytes and giving up after deadline seconds. If a sink is
+        given, every chunk is fed to it as it arrives and reading stops as soon as the sink is done
+        :param url: A string containing the URL of the web page
+        :param sink: an optional object with feed(chunk), close() and a done attribute, e.g. an HTMLTextExtractor
+        :return: the raw bytes of the (possibly truncated) response body, or the closed sink if one was given
+        """
+        started = time.monotonic()
+        chunks = []
+        size = 0
+        with metrics.timer("fetch", url), self.get(url, stream=True) as res:
+            for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                chunk = chunk[:self.max_bytes - size]
+                size += len(chunk)
+                if sink is not None:
+                    with metrics.timer("html", url):
+                        sink.feed(chunk)
+                    if sink.done:
+                        break
+                else:
+                    chunks.append(chunk)
+                if size >= self.max_bytes:
+                    break
+                if time.monotonic() - started > self.deadline:
+                    break
+        metrics.add("fetch", "bytes", size, url)
+        if sink is not None:
+            with metrics.timer("html", url):
+                sink.close()
+            return sink
+        return b"".join(chunks)
+
+    def fetch_all(self, urls, sink_factory=None, started=None):
+        """
+        Download all urls concurrently and yield each page as soon as it arrives, in completion order
+        :param urls: a list of URL strings
+        :param sink_factory: an optional callable creating one sink per URL, see fetch()
+        :param started: an optional dict mapping the futures of downloads already submitted to the executor, e.g. by a
+        Prefetcher, to their URL; their pages are yielded along with the others
+        :return: a generator of (url, content, error) tuples; content is None and error is set if the download or the
+        conversion of the page failed
+        """
+        futures = dict(started or {})
+        futures.update({self.executor.submit(self.fetch, url, sink_factory() if sink_factory else None): url
+                        for url in urls})
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                # A network, decoding or parsing error, or a cancelled download, only loses this page
+                yield url, None, e
+                continue
+            yield url, content, None
+
+    def close(self):
+        """
+        Stop the worker threads and close all pooled connections
+        :return: void
+        """
+        self.executor.shutdown(wait=False)
+        self.session.close()
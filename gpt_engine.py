@@ -0,0 +1,157 @@
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sentence_memo import SentenceMemo, DEFAULT_MAX_BYTES
+
+# Errors of the openai module (openai.error) worth retrying: rate limits, timeouts, connection and server errors.
+# Anything else, e.g. an invalid key or request, fails the same way on every attempt and is raised
+RETRYABLE_ERRORS = ["RateLimitError", "Timeout", "APIConnectionError", "ServiceUnavailableError", "APIError"]
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing rate requests per second on average with bursts of up to capacity requests
+    """
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: the number of tokens added per second
+        :param capacity: the maximum number of tokens that can accumulate
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        :return: void
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class GPTEngine:
+    """
+    Sends completion requests to OpenAI concurrently under a concurrency limit and a token-bucket rate limit, retrying
+    transient failures with exponential backoff and memoizing responses by prompt hash in a bounded LRU memo. The
+    client only needs a Completion.create(**kwargs) method returning {"choices": [{"text": ...}]}, and optionally an
+    error namespace holding the RETRYABLE_ERRORS classes as openai.error does, so the openai module can be replaced by
+    a stub in tests and benchmarks.
+    """
+
+    def __init__(self, client, model='text-davinci-003', max_tokens=100, temperature=0.1, top_p=1,
+                 frequency_penalty=0, presence_penalty=0, max_workers=4, requests_per_minute=None, max_retries=5,
+                 backoff=1.0, sentences_per_prompt=1, cache=None, memo_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param client: the OpenAI API object, or any object with the same Completion.create interface
+        :param model: the name of the OpenAI model to be used for the text generation
+        :param max_tokens: the maximum number of tokens to be generated by the API
+        :param temperature: a value controlling the randomness of the generated text
+        :param top_p: a value controlling the diversity of the generated text
+        :param frequency_penalty: a value controlling the repetition of the generated text
+        :param presence_penalty: a value controlling the presence of certain words in the generated text
+        :param max_workers: the maximum number of requests in flight at the same time
+        :param requests_per_minute: the average request rate allowed by the token bucket, or None for no limit besides
+        max_workers
+        :param max_retries: the number of times a failed request is retried before giving up
+        :param backoff: the base delay in seconds of the exponential backoff between retries
+        :param sentences_per_prompt: the number of sentences packed into one prompt
+        :param cache: an optional Cache in which responses are also persisted
+        :param memo_bytes: the approximate memory budget of the in-process memo of responses
+        """
+        self.client = client
+        self.params = {"model": model, "max_tokens": max_tokens, "temperature": temperature, "top_p": top_p,
+                       "frequency_penalty": frequency_penalty, "presence_penalty": presence_penalty}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sentences_per_prompt = sentences_per_prompt
+        self.bucket = TokenBucket(requests_per_minute / 60.0, capacity=max_workers) if requests_per_minute else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.memo = SentenceMemo(memo_bytes, cache, "gpt")
+        errors = getattr(client, "error", None)
+        self.retryable = tuple(getattr(errors, name) for name in RETRYABLE_ERRORS if hasattr(errors, name))
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    @property
+    def memo_hits(self):
+        return self.memo.hits + self.memo.disk_hits
+
+    def prompt_key(self, prompt):
+        """
+        Hash a prompt together with the generation parameters
+        :param prompt: the text prompt
+        :return: the hex SHA-256 digest identifying the response
+        """
+        return hashlib.sha256((repr(sorted(self.params.items())) + prompt).encode("utf-8")).hexdigest()
+
+    def complete(self, prompt):
+        """
+        Return the completion of a prompt, from the memo if the same prompt was already sent
+        :param prompt: the text prompt to be used for the text generation
+        :return: the generated text completion, or an empty string if every attempt failed
+        """
+        key = self.prompt_key(prompt)
+        text = self.memo.get(key)
+        if text is not None:
+            return text
+
+        text = self._request(prompt)
+        if text is None:
+            return ""
+        self.memo.set(key, text)
+        return text
+
+    def _request(self, prompt):
+        """
+        Send one completion request, retrying with exponential backoff and jitter on rate limit, timeout, connection
+        and server errors; other errors are raised
+        :param prompt: the text prompt
+        :return: the generated text completion, or None if every attempt failed
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                with self._lock:
+                    self.requests += 1
+                response = self.client.Completion.create(prompt=prompt, **self.params)
+                return response['choices'][0]['text']
+            except self.retryable as e:
+                if attempt == self.max_retries:
+                    print(f"\t\tOpenAI request failed after {attempt + 1} attempts ({e}). Ignoring this prompt.")
+                    return None
+                with self._lock:
+                    self.retries += 1
+                time.sleep(self.backoff * 2 ** attempt + random.uniform(0, self.backoff))
+
+    def complete_all(self, prompts):
+        """
+        Send all prompts concurrently; identical prompts are only sent once
+        :param prompts: a list of text prompts
+        :return: a list of completions aligned with prompts
+        """
+        unique = list(dict.fromkeys(prompts))
+        completions = dict(zip(unique, self.executor.map(self.complete, unique)))
+        return [completions[prompt] for prompt in prompts]
+
+    def close(self):
+        """
+        Stop the worker threads
+        :return: void
+        """
+        self.executor.shutdown(wait=False)
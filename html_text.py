@@ -0,0 +1,325 @@
+import codecs
+import re
+from collections import defaultdict
+from html import unescape
+from html.parser import HTMLParser
+from bs4.dammit import EncodingDetector, EntitySubstitution, UnicodeDammit
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Only the first 10,000 characters of plain text of a web page are used
+MAX_CHARS = 10000
+# Number of bytes buffered to detect the encoding of the page before decoding starts
+HEAD_BYTES = 64 * 1024
+
+# Tags removed from the soup before calling get_text()
+EXTRACTED_TAGS = {"style", "script", "head", "title"}
+# Tags whose strings BeautifulSoup stores with a special string class that get_text() leaves out
+STRING_CONTAINER_TAGS = {"style", "script", "template", "rt", "rp"}
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+EMPTY_ELEMENT_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+                      "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+                      "nextid", "spacer"}
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# Any run of spaces, non-breaking spaces, tabs and newlines becomes a single space
+WHITESPACE_RUN = re.compile("[ \xa0\t\n]+")
+# Characters that may disappear during normalization or stripping
+NOT_SOLID = re.compile(r"[\s\u200b]")
+NUMERIC_REFERENCE_WITH_FOLLOWING_DATA = re.compile("^([0-9]+)(.*)")
+HEX_REFERENCE_WITH_FOLLOWING_DATA = re.compile("^([0-9a-fA-F]+)(.*)")
+
+
+def normalize_text(txt):
+    """
+    Collapse whitespace in a single pass; equivalent to replacing '\\xa0' with ' ', then '\\t+', '\\n+' and ' +' with
+    ' ', then removing '\\u200b'
+    :param txt: the stripped plain text of a web page
+    :return: the normalized text
+    """
+    return WHITESPACE_RUN.sub(" ", txt).replace("\u200b", "")
+
+
+def numeric_character_reference(number):
+    """
+    Resolve a numeric character reference as the installed BeautifulSoup does
+    :param number: the code point of the reference
+    :return: the referenced character(s)
+    """
+    if hasattr(UnicodeDammit, "numeric_character_reference"):
+        return UnicodeDammit.numeric_character_reference(number)[0]
+    return unescape("&#%d;" % number)
+
+
+class TextCollector:
+    """
+    Receives parser events and keeps the strings BeautifulSoup's get_text() would return once script, style, head and
+    title tags are extracted. It stops accepting text once the character budget is certainly filled.
+    """
+
+    def __init__(self, max_chars=MAX_CHARS):
+        self.max_chars = max_chars
+        self.stack = []
+        self.open_tags = defaultdict(int)
+        self.current_data = []
+        self.pieces = []
+        # Number of characters collected that survive stripping and normalization
+        self.solid = 0
+        self.done = False
+        # Whether text() dropped characters to keep max_chars
+        self.truncated = False
+
+    def start(self, name):
+        self.end_data()
+        self.stack.append(name)
+        self.open_tags[name] += 1
+
+    def end(self, name):
+        self.end_data()
+        if not self.open_tags[name]:
+            return
+        # Like BeautifulSoup, close every tag opened after the most recent one with this name
+        while self.stack:
+            tag = self.stack.pop()
+            self.open_tags[tag] -= 1
+            if tag == name:
+                break
+
+    def data(self, data):
+        self.current_data.append(data)
+
+    def end_data(self, kind="text"):
+        """
+        Turn the data received since the last event into one string
+        :param kind: "text", "cdata", or "other" for comments, declarations and processing instructions
+        :return: void
+        """
+        if not self.current_data:
+            return
+        data = "".join(self.current_data)
+        self.current_data = []
+        if not any(self.open_tags[tag] for tag in PRESERVE_WHITESPACE_TAGS) and \
+                all(c in ASCII_SPACES for c in data):
+            data = "\n" if "\n" in data else " "
+        if kind == "other" or self.done:
+            return
+        hidden = EXTRACTED_TAGS if kind == "cdata" else EXTRACTED_TAGS | STRING_CONTAINER_TAGS
+        if any(self.open_tags[tag] for tag in hidden):
+            return
+        self.pieces.append(data)
+        self.solid += len(data) - len(NOT_SOLID.findall(data))
+        if self.solid > self.max_chars:
+            self.done = True
+
+    def text(self):
+        """
+        :return: the stripped, normalized text truncated to max_chars characters
+        """
+        self.end_data()
+        text = normalize_text("".join(self.pieces).strip())
+        # Not the same as done: the single spaces left between words may take the text over max_chars
+        self.truncated = len(text) > self.max_chars
+        return text[:self.max_chars]
+
+
+class StdlibParser(HTMLParser):
+    """
+    html.parser event handler reproducing how BeautifulSoup's html.parser tree builder handles empty-element tags,
+    stray end tags, character references, comments and declarations
+    """
+
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=False)
+        self.collector = collector
+        self.already_closed_empty_element = []
+
+    def handle_starttag(self, tag, attrs, handle_empty_element=True):
+        self.collector.start(tag)
+        if handle_empty_element and tag in EMPTY_ELEMENT_TAGS:
+            self.handle_endtag(tag, check_already_closed=False)
+            self.already_closed_empty_element.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, handle_empty_element=False)
+        self.handle_endtag(tag, check_already_closed=False)
+
+    def handle_endtag(self, tag, check_already_closed=True):
+        if check_already_closed and tag in self.already_closed_empty_element:
+            self.already_closed_empty_element.remove(tag)
+        else:
+            self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+    def handle_charref(self, name):
+        hex_reference = name[:1] in ("x", "X")
+        if hex_reference:
+            name = name[1:]
+            match = HEX_REFERENCE_WITH_FOLLOWING_DATA.match(name)
+        else:
+            match = NUMERIC_REFERENCE_WITH_FOLLOWING_DATA.match(name)
+        if match is None:
+            self.collector.data(name)
+            return
+        self.collector.data(numeric_character_reference(int(match.group(1), 16 if hex_reference else 10)))
+        if match.group(2):
+            self.collector.data(match.group(2))
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.collector.data(character if character is not None else "&%s" % name)
+
+    def _handle_other(self, data, kind="other"):
+        self.collector.end_data()
+        self.collector.data(data)
+        self.collector.end_data(kind)
+
+    def handle_comment(self, data):
+        self._handle_other(data)
+
+    def handle_decl(self, decl):
+        self._handle_other(decl)
+
+    def handle_pi(self, data):
+        self._handle_other(data)
+
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self._handle_other(data[len("CDATA["):], "cdata")
+        else:
+            self._handle_other(data)
+
+
+class LxmlTarget:
+    """
+    lxml parser target forwarding events to a TextCollector. libxml2 repairs broken markup differently from
+    html.parser, so the text can differ slightly from the html.parser backend on malformed pages.
+    """
+
+    def __init__(self, collector):
+        self.collector = collector
+
+    def start(self, tag, attrib):
+        self.collector.start(tag)
+
+    def end(self, tag):
+        self.collector.end(tag)
+
+    def data(self, data):
+        self.collector.data(data)
+
+    def comment(self, text):
+        self.collector.end_data()
+
+    def close(self):
+        self.collector.end_data()
+
+
+class HTMLTextExtractor:
+    """
+    Incremental HTML to plain text converter. Response chunks are fed as they are downloaded; script, style, head and
+    title content is skipped while parsing, and once the 10,000 character budget is filled done becomes True so that
+    the caller can stop reading. The text is the same as BeautifulSoup(content, 'html.parser') followed by the
+    whitespace normalization and truncation ise.py always did.
+    """
+
+    def __init__(self, max_chars=MAX_CHARS, backend="html.parser"):
+        """
+        :param max_chars: the number of characters of plain text to keep
+        :param backend: "html.parser" (default) or "lxml", which is faster but needs the lxml package
+        """
+        self.collector = TextCollector(max_chars)
+        self.backend = backend
+        self.bytes_read = 0
+        self.text = None
+        self._head = []
+        self._decoder = None
+        self._parser = None
+        if backend == "lxml" and etree is None:
+            raise ValueError("The lxml backend needs the lxml package: pip3 install lxml")
+        if backend not in ("html.parser", "lxml"):
+            raise ValueError("Unknown HTML backend: " + backend)
+
+    @property
+    def done(self):
+        return self.collector.done
+
+    @property
+    def truncated(self):
+        return self.collector.truncated
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of the response body
+        :param chunk: raw bytes
+        :return: void
+        """
+        self.bytes_read += len(chunk)
+        if self._parser is None:
+            self._head.append(chunk)
+            if sum(len(c) for c in self._head) >= HEAD_BYTES:
+                self._start_parsing(final=False)
+        elif self.backend == "lxml":
+            self._parser.feed(chunk)
+        else:
+            self._parser.feed(self._decoder.decode(chunk))
+
+    def _start_parsing(self, final):
+        """
+        Detect the encoding of the buffered head of the page the way BeautifulSoup does, then start parsing it
+        :param final: True if the head is the whole page
+        :return: void
+        """
+        head = b"".join(self._head)
+        self._head = []
+        head, bom_encoding = EncodingDetector.strip_byte_order_mark(head)
+        sample = head
+        if not final:
+            # Cut after the last ASCII byte so that no multi-byte character is split
+            cut = len(head)
+            while cut > 0 and head[cut - 1] >= 0x80:
+                cut -= 1
+            sample = head[:cut] or head
+        encoding = bom_encoding or (UnicodeDammit(sample, is_html=True).original_encoding if sample else None)
+        if encoding is None or encoding.lower() in ("ascii", "us-ascii"):
+            encoding = "utf-8"
+        if self.backend == "lxml":
+            self._parser = etree.HTMLParser(target=LxmlTarget(self.collector), encoding=encoding)
+            self._parser.feed(head)
+        else:
+            self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            self._parser = StdlibParser(self.collector)
+            self._parser.feed(self._decoder.decode(head, final=final))
+
+    def close(self):
+        """
+        Finish parsing, unless the budget is already filled, and compute the text
+        :return: the plain text of the web page, at most max_chars characters long
+        """
+        if not self.done:
+            if self._parser is None:
+                self._start_parsing(final=True)
+            elif self.backend != "lxml":
+                self._parser.feed(self._decoder.decode(b"", final=True))
+            if not self.done:
+                self._parser.close()
+        self.text = self.collector.text()
+        return self.text
+
+
+def html_to_text(content, max_chars=MAX_CHARS, backend="html.parser"):
+    """
+    Convert a complete HTML document to plain text
+    :param content: the raw bytes of the web page
+    :param max_chars: the number of characters of plain text to keep
+    :param backend: "html.parser" or "lxml"
+    :return: the closed HTMLTextExtractor, holding the text, whether it was truncated and the bytes read
+    """
+    extractor = HTMLTextExtractor(max_chars, backend)
+    extractor.feed(content)
+    extractor.close()
+    return extractor
@@ -1,18 +1,27 @@
 import json
-import requests
 import sys
-from bs4 import BeautifulSoup
-from bs4.element import Comment
 import os
-import re
-import spacy
-from spanbert import SpanBERT
-from new_help_functions import extract_relations_spbt, extract_relations_gpt
+from itertools import chain
+from concurrent.futures.process import BrokenProcessPool
+from model_registry import registry
+from fetcher import PageFetcher
+from html_text import HTMLTextExtractor, html_to_text, MAX_CHARS
+from gpt_engine import GPTEngine
+from extraction_pool import ExtractionPool
+from tuple_store import TupleStore
+from output_sink import open_sink, load_records, DEFAULT_FLUSH_EVERY
+from checkpoint import Checkpoint, DEFAULT_CHECKPOINT_PATH
+from metrics import metrics, Profiler
+from dedup import DuplicateFilter, canonical_url, DEFAULT_MAX_DISTANCE
+from sentence_memo import SentenceMemo, memo_stats
+from prefetch import Prefetcher, DEFAULT_MAX_SEARCHES
+from cache import Cache, content_key, DEFAULT_CACHE_PATH, DEFAULT_TTL
+from new_help_functions import extract_relations_spbt, extract_relations_gpt, prefilter_stats
 import openai
 
 
 class ISE:
-    def __init__(self):
+    def __init__(self, models=registry, fetcher=None):
         self.relation_map = {1: ("Schools_Attended", "per:schools_attended", ["PERSON"], ["ORGANIZATION"]),
                              2: ("Work_For", "per:employee_of", ["PERSON"], ["ORGANIZATION"]),
                              3: ("Live_In", "per:cities_of_residence", ["PERSON"],
@@ -21,8 +30,11 @@ class ISE:
 
         self.queries = set()
 
-        # (subj, relation, obj) -> confidence score
-        self.X = {}
+        # (subj, relation, obj) -> confidence score, with the tuples not used as queries yet kept in a max-heap
+        self.X = TupleStore()
+
+        # Custom Search JSON API endpoint; benchmarks point it to a local stub server
+        self.SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
 
         # Parameters from input
         self.GOOGLE_JSON_API_KEY = ""
@@ -33,20 +45,83 @@ class ISE:
         self.THRESHOLD = 0
         self.QUERY = ""
         self.k = 0
+        # The query of the first iteration; tuples it already contains are never selected as queries
+        self.seed_query = ""
+        # Optional parameters given as --name=value
+        self.options = {}
+        self.BATCH_SIZE = 32
+        # nlp.pipe settings used to annotate the pages of an iteration
+        self.SPACY_BATCH_SIZE = 4
+        self.N_PROCESS = 1
+        # "html.parser" or "lxml"
+        self.HTML_BACKEND = "html.parser"
+        # Number of processes extracting relations from the pages of an iteration; 1 extracts in this process
+        self.WORKERS = 1
 
         # Retrieved set
         self.retrieved_url = set()
+        # URLs already returned by a search, those completely processed, and the current iteration; restored when a
+        # run is resumed
+        self.seen_URLs = set()
+        self.processed_URLs = set()
+        self.iteration = 1
+        self.resumed = False
+
+        # spaCy / SpanBERT models, loaded once and kept resident for the whole run
+        self.models = models
+
+        # Pooled HTTP client used for the search API and for page downloads, possibly shared with other instances
+        self.fetcher = fetcher or PageFetcher()
+
+        # On-disk cache of search results, page text and extracted tuples; None when disabled with --no-cache
+        self.cache = None
+
+        # Concurrent, rate-limited OpenAI client shared by all pages of the run (GPT-3 method only)
+        self.gpt_engine = None
+
+        # Worker processes running spaCy and the extraction when WORKERS > 1
+        self.pool = None
+
+        # Streaming output of every accepted tuple with its provenance, enabled with --output=<path>
+        self.sink = None
 
-    def google_search(self):
+        # Append-only log of the expansion state, written after every page; None when disabled with --no-checkpoint
+        self.checkpoint = None
+
+        # Near-duplicate pages and sentences already processed in this run; None when disabled with --no-dedup
+        self.dedup = DuplicateFilter()
+
+        # SpanBERT predictions of the sentences seen so far, bounded in memory and persisted in the cache if enabled
+        self.memo = SentenceMemo()
+
+        # Background search and download of the pages of the predicted next query, enabled with --prefetch, and the
+        # downloads it handed over to the current iteration (URL -> future)
+        self.prefetcher = None
+        self.prefetched = {}
+
+        # Position of each URL in the search results of the current iteration, and the number of results, shown in the
+        # progress output
+        self.result_ranks = {}
+        self.result_count = 0
+
+    def google_search(self, query=None):
         """
         Return the Top-10 results of Google search using QUERY
+        :param query: the query to search instead of QUERY, e.g. a speculative one
         :return: A list of dicts; each dict represents one search result containing the URL, Title, and Summary
         """
         results = []
+        query = self.QUERY if query is None else query
+        key = content_key(self.GOOGLE_ENGINE_ID, query)
+        if self.cache is not None:
+            cached = self.cache.get("search", key)
+            if cached is not None:
+                return cached
 
         # Google search
-        url = "https://www.googleapis.com/customsearch/v1?key=" + self.GOOGLE_JSON_API_KEY + "&cx=" + self.GOOGLE_ENGINE_ID + "&q=" + self.QUERY
-        response = requests.get(url)
+        url = self.SEARCH_URL + "?key=" + self.GOOGLE_JSON_API_KEY + "&cx=" + self.GOOGLE_ENGINE_ID + "&q=" + query
+        with metrics.timer("search"):
+            response = self.fetcher.get(url)
         search_results = json.loads(response.text)['items']
 
         for i in range(0, 10):
@@ -57,6 +132,8 @@ class ISE:
             }
             results.append(result)
 
+        if self.cache is not None:
+            self.cache.set("search", key, results)
         return results
 
     def read_params(self):
@@ -64,11 +141,20 @@ class ISE:
         Read parameters from the command line and assign them to global vars
         :return: void
         """
-        inputs = sys.argv
+        inputs = [arg for arg in sys.argv if not arg.startswith("--")]
+        self.options = dict((arg[2:].split("=", 1) + [""])[:2] for arg in sys.argv if arg.startswith("--"))
 
         if len(inputs) < 8:
             print("Please enter valid usage: python3 ise.py [-spanbert|-gpt3] "
-                  "<google api key> <google engine id> <openai secret key> <r> <t> <q> <k>")
+                  "<google api key> <google engine id> <openai secret key> <r> <t> <q> <k> [--batch-size=<n>] "
+                  "[--no-cache] [--clear-cache] [--cache=<path>] [--cache-ttl=<seconds>] "
+                  "[--spacy-model=<name>] [--spanbert-backend=fp32|int8|onnx|onnx-int8] [--spacy-batch-size=<n>] "
+                  "[--n-process=<n>] "
+                  "[--gpt-workers=<n>] [--gpt-rpm=<n>] [--gpt-pack=<n>] [--html-backend=html.parser|lxml] "
+                  "[--workers=<n>] [--output=<path.jsonl|path.parquet>] [--output-every=<n>] [--resume-output] "
+                  "[--checkpoint=<path>] [--no-checkpoint] [--resume] [--metrics[=<path.json>]] "
+                  "[--profile=cprofile|pyinstrument] [--profile-out=<path>] [--no-dedup] [--near-dup-bits=<n>] "
+                  "[--memo-size=<MiB>] [--prefetch] [--prefetch-searches=<n>]")
             sys.exit(1)
 
         self.METHOD = inputs[1]
@@ -78,7 +164,43 @@ class ISE:
         self.RELATION = int(inputs[5])
         self.THRESHOLD = float(inputs[6])
         self.QUERY = inputs[7]
+        self.seed_query = self.QUERY
         self.k = int(inputs[8])
+        self.BATCH_SIZE = int(self.options.get("batch-size", self.BATCH_SIZE))
+        if "no-cache" not in self.options:
+            self.cache = Cache(self.options.get("cache", DEFAULT_CACHE_PATH),
+                               int(self.options.get("cache-ttl", DEFAULT_TTL)))
+            if "clear-cache" in self.options:
+                self.cache.clear()
+        self.SPACY_BATCH_SIZE = int(self.options.get("spacy-batch-size", self.SPACY_BATCH_SIZE))
+        self.N_PROCESS = int(self.options.get("n-process", self.N_PROCESS))
+        self.HTML_BACKEND = self.options.get("html-backend", self.HTML_BACKEND)
+        if "spacy-model" in self.options:
+            self.models.set_spacy_model(self.options["spacy-model"])
+        if "spanbert-backend" in self.options:
+            self.models.set_spanbert_backend(self.options["spanbert-backend"])
+        gpt_workers = int(self.options.get("gpt-workers", 4))
+        gpt_rpm = float(self.options["gpt-rpm"]) if "gpt-rpm" in self.options else None
+        gpt_pack = int(self.options.get("gpt-pack", 1))
+        memo_bytes = int(float(self.options.get("memo-size", 64)) * 1024 * 1024)
+        self.memo = SentenceMemo(memo_bytes, self.cache)
+        if self.METHOD == "-gpt3":
+            openai.api_key = self.OPENAI_KEY
+            self.gpt_engine = GPTEngine(openai, max_workers=gpt_workers, requests_per_minute=gpt_rpm,
+                                        sentences_per_prompt=gpt_pack, cache=self.cache, memo_bytes=memo_bytes)
+        metrics.enabled = "metrics" in self.options
+        if "no-dedup" in self.options:
+            self.dedup = None
+        else:
+            self.dedup = DuplicateFilter(int(self.options.get("near-dup-bits", DEFAULT_MAX_DISTANCE)))
+        if "no-checkpoint" not in self.options:
+            self.checkpoint = Checkpoint(self.options.get("checkpoint", DEFAULT_CHECKPOINT_PATH))
+        self.WORKERS = int(self.options.get("workers", self.WORKERS))
+        if self.WORKERS > 1:
+            self.pool = ExtractionPool(self.WORKERS, self.models, [self.METHOD], self.BATCH_SIZE, self.OPENAI_KEY,
+                                       gpt_workers, gpt_rpm, gpt_pack, memo_bytes, self.cache)
+        if "prefetch" in self.options:
+            self.enable_prefetch(int(self.options.get("prefetch-searches", DEFAULT_MAX_SEARCHES)))
 
         # Print to console
         print("Parameters:")
@@ -92,116 +214,513 @@ class ISE:
         print("# of Tuples \t= " + str(self.k))
         print("Loading necessary libraries; This should take a minute or so...")
 
+    def open_output(self):
+        """
+        Open the output sink given by --output. With --resume-output, the tuples of the previous run written to the
+        same path are loaded first, so that the run continues where it stopped instead of starting over
+        :return: void
+        """
+        if "output" not in self.options:
+            return
+        path = self.options["output"]
+        if "resume-output" in self.options:
+            self.resume_output(load_records(path))
+        # A resumed run appends to the output of the run it continues; any other run starts a new output
+        self.sink = open_sink(path, int(self.options.get("output-every", DEFAULT_FLUSH_EVERY)),
+                              "resume-output" in self.options or "resume" in self.options)
+
+    def resume_output(self, records):
+        """
+        Restore X, the processed URLs, the iteration and the query from the records of a previous run. The iteration
+        the run stopped in is finished first, with the same query; the pages whose "page" record was written are not
+        processed again, while the tuples of a page without one are ignored and the page is processed again
+        :param records: the output records of the previous run, in the order they were written
+        :return: void
+        """
+        completed = {record["url"] for record in records if record.get("type") == "page"}
+        if not completed:
+            return
+        for record in records:
+            if record.get("type") == "page":
+                self.seen_URLs.add(self.url_key(record["url"]))
+            elif record["url"] in completed:
+                self.X.upsert((record["subject"], record["relation"], record["object"]), record["confidence"])
+        last = [record for record in records if record.get("type") == "page"][-1]
+        self.iteration = last["iteration"]
+        self.QUERY = last["query"]
+        self.resumed = True
+        print(f"Resumed {len(self.X)} tuples from {len(self.seen_URLs)} web pages; continuing iteration "
+              f"{self.iteration} with query: {self.QUERY}")
+
+    def open_checkpoint(self):
+        """
+        Start the checkpoint log of this run. With --resume, the state logged by the previous run is restored first
+        so that the run picks up exactly where it stopped
+        :return: void
+        """
+        if self.checkpoint is None:
+            return
+        if "resume" in self.options:
+            self.restore_checkpoint(self.checkpoint.load())
+        self.checkpoint.compact(self.checkpoint_snapshot())
+
+    def checkpoint_snapshot(self):
+        """
+        :return: a JSON-serializable dict holding the full expansion state and the parameters it depends on
+        """
+        return {"op": "snapshot", "method": self.METHOD, "relation": self.RELATION, "threshold": self.THRESHOLD,
+                "iteration": self.iteration, "query": self.QUERY, "seed_query": self.seed_query,
+                "X": [list(tup) + [float(confidence)] for tup, confidence in self.X.items()],
+                "used": [list(tup) for tup in self.X.used], "processed": sorted(self.processed_URLs)}
+
+    def restore_checkpoint(self, records):
+        """
+        Replay a checkpoint log: its snapshot, then every iteration and page recorded after it
+        :param records: the records returned by Checkpoint.load()
+        :return: void
+        """
+        if not records:
+            print("No checkpoint to resume from; starting from the seed query")
+            return
+        snapshot = records[0]
+        if (snapshot["method"], snapshot["relation"], snapshot["threshold"]) != \
+                (self.METHOD, self.RELATION, self.THRESHOLD):
+            print(f"The checkpoint was written by a run with a different method, relation or threshold "
+                  f"({snapshot['method'][1:]}, {snapshot['relation']}, {snapshot['threshold']}). Exiting.")
+            sys.exit(1)
+        self.iteration = snapshot["iteration"]
+        self.QUERY = snapshot["query"]
+        self.seed_query = snapshot.get("seed_query", self.seed_query)
+        for subj, relation, obj, confidence in snapshot["X"]:
+            self.X.upsert((subj, relation, obj), confidence)
+        for tup in snapshot["used"]:
+            self.X.mark_used(tuple(tup))
+        self.processed_URLs.update(snapshot["processed"])
+        for record in records[1:]:
+            if record["op"] == "iteration":
+                self.iteration = record["iteration"]
+                self.QUERY = record["query"]
+                if record["tuple"] is not None:
+                    self.X.mark_used(tuple(record["tuple"]))
+            elif record["op"] == "page":
+                self.processed_URLs.add(record["url"])
+                for subj, relation, obj, confidence in record["relations"]:
+                    self.X.upsert((subj, relation, obj), confidence)
+        self.seen_URLs.update(self.url_key(url) for url in self.processed_URLs)
+        self.resumed = True
+        print(f"Resumed {len(self.X)} tuples from {len(self.processed_URLs)} processed web pages; continuing iteration "
+              f"{self.iteration} with query: {self.QUERY}")
+
+    def log_checkpoint(self, record):
+        """
+        Append a state change to the checkpoint log, compacting the log when it has grown long enough
+        :param record: an "iteration" or "page" record
+        :return: void
+        """
+        if self.checkpoint is None:
+            return
+        self.checkpoint.append(record)
+        if self.checkpoint.compaction_due:
+            self.checkpoint.compact(self.checkpoint_snapshot())
+
+    def record_page(self, url, relations):
+        """
+        Mark a web page as completely processed and log it with its relations to the checkpoint
+        :param url: the URL of the web page
+        :param relations: the dictionary of relations extracted from it (empty if it could not be fetched)
+        :return: void
+        """
+        self.processed_URLs.add(url)
+        if self.sink is not None:
+            # The tuples of the page must be on disk before the checkpoint marks it as processed
+            self.sink.end_page(url, self.iteration, self.QUERY, sync=self.checkpoint is not None)
+        self.log_checkpoint({"op": "page", "url": url,
+                             "relations": [list(tup) + [float(confidence)] for tup, confidence in relations.items()]})
+
+    def enable_prefetch(self, max_searches=DEFAULT_MAX_SEARCHES):
+        """
+        Search and download the pages of the next iteration in the background while the current one is extracted
+        :param max_searches: the number of speculative searches allowed per iteration
+        :return: void
+        """
+        self.prefetcher = Prefetcher(self.google_search, self.fetcher, self.text_extractor, self.url_key, self.cache,
+                                     max_searches)
+
+    def speculate(self):
+        """
+        Start the speculative search of the query the next iteration would use if X did not change any more: the
+        current query with the best unused tuple appended. Called after every page, so the speculation follows the
+        best tuple as the iteration goes on
+        :return: void
+        """
+        if self.prefetcher is None or len(self.X) >= self.k:
+            return
+        # The selection skips the tuples of the seed query; they are only marked as used by the selection itself
+        for tup in self.X.query_candidates():
+            if (tup[0] + " " + tup[2]) not in self.seed_query:
+                self.prefetcher.speculate(self.QUERY + ' ' + tup[0] + ' ' + tup[2], frozenset(self.seen_URLs))
+                break
+
+    def url_key(self, url):
+        """
+        :param url: a URL returned by the search
+        :return: the key identifying the URL in seen_URLs; URL variants share the same key unless dedup is disabled
+        """
+        return canonical_url(url) if self.dedup is not None else url
+
+    def write_output(self, tup, confidence, url, sentences):
+        """
+        Write one accepted tuple with its provenance to the output sink
+        :param tup: a (subj, relation, obj) tuple
+        :param confidence: its confidence score
+        :param url: the URL of the web page it was extracted from
+        :param sentences: a dictionary mapping tuples to the text of their sentence, or None
+        :return: void
+        """
+        self.sink.write({"subject": tup[0], "relation": tup[1], "object": tup[2], "confidence": float(confidence),
+                         "url": url, "sentence": (sentences or {}).get(tup, ""), "iteration": self.iteration,
+                         "query": self.QUERY})
+
     def extract_plain_text(self, url):
         """
         Extract plain text from a web page pointed by url
         :param url: A string containing the URL of the web page
         :return: A list of strings, each string represents a sentence from the plain text of the web page
         """
-        res = requests.get(url)
-        soup = BeautifulSoup(res.content, 'html.parser')
-        [s.extract() for s in soup(['style', 'script', '[document]', 'head', 'title'])]
-        txt = soup.getText().strip()
-        # Removing redundant newlines and some whitespace characters
-        txt = re.sub(u'\xa0', ' ', txt)
+        if self.cache is not None:
+            text = self.cache.get("page", url)
+            if text is not None:
+                return text
+        text = self.page_text(self.fetcher.fetch(url, self.text_extractor()))
+        if self.cache is not None:
+            self.cache.set("page", url, text)
+        return text
 
-        txt = re.sub('\t+', ' ', txt)
+    def text_extractor(self):
+        """
+        Create the streaming HTML to text converter fed by the fetcher while a web page downloads
+        :return: an HTMLTextExtractor keeping the first 10,000 characters of plain text
+        """
+        return HTMLTextExtractor(MAX_CHARS, self.HTML_BACKEND)
 
-        txt = re.sub('\n+', ' ', txt)
+    def page_text(self, extractor):
+        """
+        Return the plain text of a converted web page, reporting whether it was truncated
+        :param extractor: a closed HTMLTextExtractor
+        :return: A string containing the plain text of the web page
+        """
+        if extractor.truncated:
+            print(f'\tTrimming webpage content to {MAX_CHARS} characters (stopped reading after '
+                  f'{extractor.bytes_read} bytes)')
+        return extractor.text
+
+    def clean_html(self, content):
+        """
+        Convert the raw HTML of a web page to plain text, truncated to its first 10,000 characters
+        :param content: the raw bytes of the web page
+        :return: A string containing the plain text of the web page
+        """
+        return self.page_text(html_to_text(content, MAX_CHARS, self.HTML_BACKEND))
 
-        txt = re.sub(' +', ' ', txt)
+    def cached_relations(self, text, target_relation, sentences=None):
+        """
+        Look up the relations previously extracted from the same text with the same method, relation and threshold
+        :param text: the text to analyze
+        :param target_relation: the target relation to filter the extracted relations
+        :param sentences: an optional dictionary in which the cached sentence of each relation is stored
+        :return: a dictionary of relations, or None if they are not cached
+        """
+        if self.cache is None:
+            return None
+        cached = self.cache.get("extraction", content_key(text, self.METHOD, target_relation, self.THRESHOLD))
+        if cached is None:
+            return None
+        print("\tUsing cached extraction results for this webpage")
+        relations = {}
+        for subj, relation, obj, confidence, *sentence in cached:
+            relations[(subj, relation, obj)] = confidence
+            if sentences is not None and sentence:
+                sentences[(subj, relation, obj)] = sentence[0]
+        return relations
 
-        txt = txt.replace('\u200b', '')
-        # the resulting plain text is longer than 10,000 characters, truncate the text to its first 10,000 characters
-        if len(txt) > 10000:
-            print(f'\tTrimming webpage content from {len(txt)} to 10000 characters')
-            txt = txt[:10000]
-        return txt
+    def store_relations(self, text, target_relation, relations, sentences=None):
+        """
+        Cache the relations extracted from a text so that cached_relations() returns them next time
+        :param text: the analyzed text
+        :param target_relation: the target relation to filter the extracted relations
+        :param relations: the dictionary of relations extracted from text
+        :param sentences: an optional dictionary mapping each relation to the text of its sentence
+        :return: void
+        """
+        if self.cache is not None and relations != "no_relation":
+            sentences = sentences or {}
+            self.cache.set("extraction", content_key(text, self.METHOD, target_relation, self.THRESHOLD),
+                           [list(tup) + [confidence, sentences.get(tup, "")] for tup, confidence in relations.items()])
 
-    def extract_relations(self, text, entities_of_interest, target_relation):
+    def extract_relations(self, text, entities_of_interest, target_relation, doc=None, sentences=None):
         """
         Extract relations between entities of interest in the given text using either SpanBERT or GPT-3 method depending
         on the flag. The resulting relations are filtered based on the provided target relation.
         :param text: the text to analyze
         :param entities_of_interest: a list of entities of interest
         :param target_relation: the target relation to filter the extracted relations
+        :param doc: the spaCy annotation of text if it has already been computed, e.g. by annotate()
+        :param sentences: an optional dictionary in which the text of the sentence of each relation is stored
         :return: a list of relations filtered by the target relation
         """
         relations = "no_relation"
-        nlp = spacy.load("en_core_web_lg")
-        doc = nlp(text)
+        seen_sentences = self.dedup.sentences if self.dedup is not None else None
+        # Counters of this page only, as prefilter_stats may be updated by other jobs at the same time
+        stats = {}
+        if doc is None:
+            cached = self.cached_relations(text, target_relation, sentences)
+            if cached is not None:
+                return cached
+            nlp = self.models.get_nlp()
+            doc = nlp(text)
 
         if self.METHOD == "-spanbert":
-            spanbert = SpanBERT("./pretrained_spanbert")
-            relations = extract_relations_spbt(doc, spanbert, entities_of_interest, self.THRESHOLD, target_relation)
+            spanbert = self.models.get_spanbert()
+            relations = extract_relations_spbt(doc, spanbert, entities_of_interest, self.THRESHOLD, target_relation,
+                                               self.BATCH_SIZE, sentences, seen_sentences, self.memo, stats)
         if self.METHOD == "-gpt3":
-            openai.api_key = self.OPENAI_KEY
-            relations = extract_relations_gpt(doc, openai, entities_of_interest, self.relation_map[self.RELATION][0])
+            if self.gpt_engine is None:
+                openai.api_key = self.OPENAI_KEY
+                self.gpt_engine = GPTEngine(openai, cache=self.cache)
+            relations = extract_relations_gpt(doc, openai, entities_of_interest, self.relation_map[self.RELATION][0],
+                                              self.gpt_engine, sentences, seen_sentences, stats)
+        # Relations of a page whose sentences were partly skipped depend on the pages before it; they are not cached
+        if not stats.get("duplicates"):
+            self.store_relations(text, target_relation, relations, sentences)
         return relations
 
-    def add_tups_to_set(self, relations):
+    def extract_parallel(self, urls, entities_of_interest, target_relation):
+        """
+        Extract relations from the pages of an iteration on the worker pool. Pages are handed to the workers as soon
+        as their text is available, and the results are merged into X in the order of the search results, so that the
+        outcome and the console output do not depend on which worker finishes first
+        :param urls: the URLs of the pages not processed yet, in search result order
+        :param entities_of_interest: a list of entities of interest
+        :param target_relation: the target relation to filter the extracted relations
+        :return: void
+        """
+        # The pages of an iteration are extracted concurrently, so they only skip the sentences of earlier iterations,
+        # which the workers read once from the file written by share()
+        shared = self.pool.share(self.dedup.sentences) if self.dedup is not None else None
+        try:
+            self.merge_parallel(urls, entities_of_interest, target_relation, shared)
+        finally:
+            if shared is not None:
+                self.pool.unshare(shared)
+
+    def merge_parallel(self, urls, entities_of_interest, target_relation, shared):
+        """
+        Submit the pages of an iteration to the worker pool and merge their results in search result order. A page
+        that processed a sentence of an earlier page of the same iteration is extracted again skipping it, so the
+        outcome is the same as when the pages are extracted one after the other in this process
+        :param urls: the URLs of the pages not processed yet, in search result order
+        :param entities_of_interest: a list of entities of interest
+        :param target_relation: the target relation to filter the extracted relations
+        :param shared: the path returned by ExtractionPool.share for the sentences already processed, or None
+        :return: void
+        """
+        def submit(text, seen_sentences=None):
+            return self.pool.submit(text, entities_of_interest, target_relation, self.METHOD, self.THRESHOLD,
+                                    self.relation_map[self.RELATION][0], shared, seen_sentences)
+
+        pending = {url: (text, submit(text)) for text, url in self.page_texts(urls, target_relation)}
+        for url in urls:
+            if url not in pending:
+                continue
+            text, future = pending[url]
+            print(f'\n\tExtracting relations from {url}')
+            try:
+                relations, sentences, log, stats, page_metrics, new_sentences = future.result()
+                if self.dedup is not None and not self.dedup.sentences.isdisjoint(new_sentences):
+                    metrics.merge(page_metrics, url)
+                    relations, sentences, log, stats, page_metrics, new_sentences = submit(
+                        text, seen_sentences=[key for key in new_sentences if key in self.dedup.sentences]).result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                # The page is not marked as processed, so a resumed run tries it again
+                print(f'\tUnable to extract relations from this webpage ({type(e).__name__}: {e}). Move onto next one.')
+                continue
+            print(log, end="")
+            for name, count in stats["prefilter"].items():
+                prefilter_stats[name] += count
+            for name, count in stats["memo"].items():
+                memo_stats[name] += count
+            metrics.merge(page_metrics, url)
+            if self.dedup is not None:
+                self.dedup.sentences.update(new_sentences)
+            if not stats["prefilter"].get("duplicates"):
+                self.store_relations(text, target_relation, relations, sentences)
+            with metrics.timer("merge", url):
+                self.report_relations(relations, url, sentences)
+
+    def annotate(self, pages):
+        """
+        Annotate the pages of an iteration together with nlp.pipe, using SPACY_BATCH_SIZE and N_PROCESS
+        :param pages: an iterable of (text, context) tuples
+        :return: a generator of (doc, context) tuples
+        """
+        nlp = self.models.get_nlp()
+        if metrics.enabled:
+            return metrics.timed_pipe("spacy", lambda items: nlp.pipe(items, as_tuples=True,
+                                                                      batch_size=self.SPACY_BATCH_SIZE,
+                                                                      n_process=self.N_PROCESS), pages)
+        return nlp.pipe(pages, as_tuples=True, batch_size=self.SPACY_BATCH_SIZE, n_process=self.N_PROCESS)
+
+    def add_tups_to_set(self, relations, url=None, sentences=None):
         """
         Add relations to the set X if they are not already in it or have a higher confidence score. Returns the count
-        of newly added relations.
+        of newly added relations. Every accepted relation is also written to the output sink, if any.
         :param relations: a dictionary of relations to add
+        :param url: the URL of the web page the relations were extracted from
+        :param sentences: an optional dictionary mapping each relation to the text of its sentence
         :return: the count of newly added relations
         """
         count = 0
         for relation in relations:
-            if relation not in self.X:
-                self.X[relation] = relations[relation]
+            accepted = relation not in self.X or self.X[relation] < relations[relation]
+            if self.X.upsert(relation, relations[relation]):
                 count += 1
-            else:
-                if self.X[relation] < relations[relation]:
-                    self.X[relation] = relations[relation]
+            if accepted and self.sink is not None:
+                self.write_output(relation, relations[relation], url, sentences)
 
         return count
 
+    def report_relations(self, relations, url=None, sentences=None):
+        """
+        Add the relations extracted from one web page to X and print how many of them are new
+        :param relations: a dictionary of relations to add
+        :param url: the URL of the web page
+        :param sentences: an optional dictionary mapping each relation to the text of its sentence
+        :return: void
+        """
+        c = self.add_tups_to_set(relations, url, sentences)
+        self.record_page(url, relations)
+        self.speculate()
+        print(f"\tRelations extracted from this website: {c} (Overall: {len(relations)})")
+
+    def page_texts(self, urls, target_relation):
+        """
+        Yield the plain text of every new web page of an iteration in the order the pages arrive. Pages are served
+        from the cache when possible and downloaded concurrently otherwise; pages whose relations are already cached
+        are reported directly and not yielded
+        :param urls: the URLs of the pages not processed yet
+        :param target_relation: the target relation to filter the extracted relations
+        :return: a generator of (text, url) tuples, ready for annotate()
+        """
+        # Pages downloaded by the prefetcher are taken over (and already stored in the cache by it)
+        prefetched = {future: url for url, future in self.prefetched.items() if url in urls}
+        self.prefetched = {}
+        cached_pages = {}
+        if self.cache is not None:
+            cached_pages = {url: self.cache.get("page", url) for url in urls if url not in prefetched.values()}
+            cached_pages = {url: text for url, text in cached_pages.items() if text is not None}
+        # Pages are downloaded concurrently and handed to spacy in the order they arrive, cached pages first
+        pages = chain(((url, None, None) for url in cached_pages),
+                      self.fetcher.fetch_all([url for url in urls
+                                              if url not in cached_pages and url not in prefetched.values()],
+                                             self.text_extractor, prefetched))
+        for url, content, error in pages:
+            print(f'\n\nURL ({self.result_ranks[url]} / {self.result_count}): {url}')
+            print("\tFetching text from url ...")
+            if error is not None:
+                print(f'\tUnable to fetch the webpage ({type(error).__name__}: {error}). Move onto next one.')
+                self.record_page(url, {})
+                continue
+            if url in cached_pages:
+                text = cached_pages[url]
+            else:
+                text = self.page_text(content)
+                if self.cache is not None and url not in prefetched.values():
+                    self.cache.set("page", url, text)
+            print(f'\tWebpage length (num characters): {len(text)}')
+            original = self.dedup.near_duplicate(url, text) if self.dedup is not None else None
+            if original is not None:
+                print(f'\tNear-duplicate of {original}. Move onto next one.')
+                self.record_page(url, {})
+                continue
+            sentences = {}
+            relations = self.cached_relations(text, target_relation, sentences)
+            if relations is not None:
+                self.report_relations(relations, url, sentences)
+                continue
+            print("\tAnnotating the webpage using spacy...")
+            yield text, url
+
     def iterative_set_expansion(self):
         """
         Perform iterative set expansion to expand the set of extracted relations until the target number of relations is reached.
         """
-        iteration_count = 1
-        seen_URLs = set()
+        iteration_count = self.iteration
+        seen_URLs = self.seen_URLs
+        # Set by read_params or restored from the checkpoint; instances set up directly start from QUERY
+        if not self.seed_query:
+            self.seed_query = self.QUERY
+        # A resumed run first finishes the iteration it stopped in, with the same query
+        select_query = not self.resumed
         while len(self.X) < self.k:
-            if iteration_count != 1:
-                selected_tup = None
-                max_confidence = -float('inf')
-                for tup, confidence in self.X.items():
-                    if (tup[0] + " " + tup[2]) not in self.QUERY:
-                        if "-spanbert" == self.METHOD:
-                            if confidence > max_confidence:
-                                max_confidence = confidence
-                                selected_tup = tup
-                        else:
-                            selected_tup = tup
-                            break
+            selected_tup = None
+            if iteration_count != 1 and select_query:
+                # The unused tuple with the highest confidence; with GPT-3 all confidences are equal, so this is the
+                # earliest extracted one. Tuples already used are tracked by the store; only the short seed query
+                # still needs a text comparison
+                selected_tup = self.X.next_query_tuple()
+                while selected_tup is not None and (selected_tup[0] + " " + selected_tup[2]) in self.seed_query:
+                    selected_tup = self.X.next_query_tuple()
                 if selected_tup is not None:
                     self.QUERY = self.QUERY + ' ' + selected_tup[0] + ' ' + selected_tup[2]
                     print("query", self.QUERY)
                 else:
                     break
+            select_query = True
+            self.iteration = iteration_count
+            self.log_checkpoint({"op": "iteration", "iteration": iteration_count, "query": self.QUERY,
+                                 "tuple": list(selected_tup) if selected_tup is not None else None})
             print(f'=========== Iteration: {iteration_count} - Query: {self.QUERY} ===========')
-            results = self.google_search()
-            result_count = 1
-            for result in results:
+            claimed = self.prefetcher.claim(self.QUERY) if self.prefetcher is not None else None
+            if claimed is not None:
+                print("Using the prefetched search results and pages of this query")
+                results, self.prefetched = claimed
+            else:
+                results = self.google_search()
+            urls = []
+            self.result_ranks = {}
+            self.result_count = len(results)
+            for rank, result in enumerate(results, 1):
                 url = result['URL']
-                print(f'\n\nURL ({result_count} / 10): {url}')
-                if url in seen_URLs:
+                key = self.url_key(url)
+                if key in seen_URLs:
+                    print(f'\n\nURL ({rank} / {self.result_count}): {url}')
                     print('This URL is processed. Move onto next one.')
+                    if self.dedup is not None:
+                        self.dedup.stats["urls"] += 1
                     continue
-                print("\tFetching text from url ...")
-                seen_URLs.add(url)
-                text = self.extract_plain_text(url)
-                print(f'\tWebpage length (num characters): {len(text)}')
-                print("\tAnnotating the webpage using spacy...")
-                target_relation = self.relation_map[self.RELATION]
-                entities_of_interest = target_relation[2] + target_relation[3]
-                relations = self.extract_relations(text, entities_of_interest, self.relation_map[self.RELATION][1])
-                c = self.add_tups_to_set(relations)
-                print(f"\tRelations extracted from this website: {c} (Overall: {len(relations)})")
-                result_count += 1
+                seen_URLs.add(key)
+                self.result_ranks[url] = rank
+                urls.append(url)
+            target_relation = self.relation_map[self.RELATION]
+            entities_of_interest = target_relation[2] + target_relation[3]
+            if self.pool is not None:
+                self.extract_parallel(urls, entities_of_interest, target_relation[1])
+            else:
+                for doc, url in self.annotate(self.page_texts(urls, target_relation[1])):
+                    print(f'\n\tExtracting relations from {url}')
+                    sentences = {}
+                    metrics.page = url
+                    with metrics.timer("extract"):
+                        relations = self.extract_relations(doc.text, entities_of_interest, target_relation[1], doc,
+                                                           sentences)
+                    with metrics.timer("merge"):
+                        self.report_relations(relations, url, sentences)
+                    metrics.page = None
             iteration_count += 1
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
         if self.METHOD == "-spanbert":
             self.summary_spbt(iteration_count - 1)
         else:
@@ -214,9 +733,8 @@ class ISE:
         """
         print(
             f'================== ALL RELATIONS for {self.relation_map[self.RELATION][1]} ( {len(self.X)} ) =================')
-        sorted_X = dict(sorted(self.X.items(), key=lambda x: x[1], reverse=True))
-        for tup in sorted_X:
-            print(f'Confidence: {self.X[tup]}   | Subject: {tup[0]}   | Object: {tup[2]}')
+        for tup, confidence in self.X.top():
+            print(f'Confidence: {confidence}   | Subject: {tup[0]}   | Object: {tup[2]}')
         print(f'Total # of iterations = {iteration_count}')
 
     def summary_gpt(self, iteration_count):
@@ -226,8 +744,7 @@ class ISE:
         """
         print(
             f'================== ALL RELATIONS for {self.relation_map[self.RELATION][0]} ( {len(self.X)} ) =================')
-        sorted_X = dict(sorted(self.X.items(), key=lambda x: x[1], reverse=True))
-        for tup in sorted_X:
+        for tup, _ in self.X.top():
             print(f'Subject: {tup[0]}   | Object: {tup[2]}')
         print(f'Total # of iterations = {iteration_count}')
 
@@ -236,7 +753,50 @@ class ISE:
         Read the parameters, perform iterative set expansion, and print a summary of the extracted relations.
         """
         self.read_params()
-        self.iterative_set_expansion()
+        self.open_output()
+        self.open_checkpoint()
+        # With the cache enabled the models are loaded lazily, as a warm rerun may not need them at all. With worker
+        # processes the models are only loaded by the workers
+        if self.cache is None and self.pool is None:
+            self.models.warm_up(self.METHOD)
+        try:
+            if "profile" in self.options:
+                with Profiler(self.options["profile"] or "cprofile", self.options.get("profile-out", "ise.prof")):
+                    self.iterative_set_expansion()
+            else:
+                self.iterative_set_expansion()
+        finally:
+            # Whatever is still buffered is written out and the worker processes and threads are stopped even if the
+            # run is interrupted
+            if self.sink is not None:
+                self.sink.close()
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+            if self.pool is not None:
+                self.pool.close()
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+        if self.prefetcher is not None:
+            print(f'Speculative searches = {self.prefetcher.stats["searches"]} (used {self.prefetcher.stats["used"]}), '
+                  f'pages prefetched = {self.prefetcher.stats["pages"]} (used {self.prefetcher.stats["pages_used"]})')
+        if self.cache is not None:
+            print(f'Cache hits = {self.cache.hits}, misses = {self.cache.misses}')
+        print(f'Sentences skipped by the entity pre-filter = {prefilter_stats["skipped"]} / '
+              f'{prefilter_stats["sentences"]}')
+        if self.dedup is not None:
+            print(f'Duplicate URLs skipped = {self.dedup.stats["urls"]}, near-duplicate pages skipped = '
+                  f'{self.dedup.stats["pages"]} ({self.dedup.stats["characters"]} characters), sentences already '
+                  f'processed skipped = {prefilter_stats["duplicates"]}')
+        print(f'Sentence memo hits = {memo_stats["hits"]} (and {memo_stats["disk_hits"]} from disk), misses = '
+              f'{memo_stats["misses"]}, evictions = {memo_stats["evictions"]}')
+        if self.gpt_engine is not None:
+            print(f'OpenAI requests = {self.gpt_engine.requests}, retries = {self.gpt_engine.retries}, '
+                  f'memoized = {self.gpt_engine.memo_hits}')
+        if metrics.enabled:
+            metrics.summary()
+            if self.options["metrics"]:
+                metrics.write(self.options["metrics"])
+                print(f'Metrics written to {self.options["metrics"]}')
 
 
 if __name__ == "__main__":
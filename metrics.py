@@ -0,0 +1,228 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Order of the stages in the summary table
+STAGES = ["search", "fetch", "html", "dedup", "spacy", "pairs", "spanbert", "gpt", "merge", "extract"]
+# Returned by Metrics.timer() when metrics are disabled, so that timing costs one attribute check
+NO_TIMER = nullcontext()
+
+
+class StageTimer:
+    """
+    Context manager adding the wall time of a block and one call to a stage
+    """
+
+    def __init__(self, metrics, stage, page):
+        self.metrics = metrics
+        self.stage = stage
+        self.page = page
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.started
+        self.metrics.add(self.stage, "calls", 1, self.page)
+        self.metrics.add(self.stage, "seconds", seconds, self.page)
+        return False
+
+
+class Metrics:
+    """
+    Per-stage and per-page counters of a run: wall time and number of calls of each stage (search, fetch, html,
+    dedup, spacy, pairs, spanbert, gpt, merge, extract) plus counts such as bytes fetched, sentences, candidate pairs and
+    model batches. Disabled by default; while disabled, timer() returns a shared no-op context manager and add()
+    returns immediately, so the instrumentation costs close to nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # stage -> counter name -> value
+        self.stages = defaultdict(lambda: defaultdict(float))
+        # page URL -> "stage.counter" -> value
+        self.pages = defaultdict(lambda: defaultdict(float))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def page(self):
+        """
+        The page being extracted by the current thread, used when add() is called without a page
+        """
+        return getattr(self._local, "page", None)
+
+    @page.setter
+    def page(self, url):
+        self._local.page = url
+
+    def reset(self):
+        """
+        Clear every counter
+        :return: void
+        """
+        with self._lock:
+            self.stages.clear()
+            self.pages.clear()
+
+    def timer(self, stage, page=None):
+        """
+        Time a block of code: with metrics.timer("spacy"): ...
+        :param stage: the name of the stage
+        :param page: the URL of the page the work belongs to; defaults to the current page
+        :return: a context manager
+        """
+        if not self.enabled:
+            return NO_TIMER
+        return StageTimer(self, stage, page)
+
+    def add(self, stage, name, value=1, page=None):
+        """
+        Add value to a counter of a stage, and of the page if one is given or current
+        :param stage: the name of the stage
+        :param name: the name of the counter, e.g. "bytes" or "sentences"
+        :param value: the amount to add
+        :param page: the URL of the page the work belongs to; defaults to the current page
+        :return: void
+        """
+        if not self.enabled:
+            return
+        page = page or self.page
+        with self._lock:
+            self.stages[stage][name] += value
+            if page is not None:
+                self.pages[page][stage + "." + name] += value
+
+    def timed_pipe(self, stage, pipe, items):
+        """
+        Time a streaming stage such as nlp.pipe whose input is itself a generator doing other work (e.g. downloads):
+        the time spent producing the input is subtracted, and each output is attributed to the page it belongs to
+        :param stage: the name of the stage
+        :param pipe: a callable turning an iterable of (item, url) tuples into a generator of (output, url) tuples
+        :param items: the input iterable of (item, url) tuples
+        :return: a generator of (output, url) tuples
+        """
+        waited = [0.0]
+
+        def source():
+            it = iter(items)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    waited[0] += time.perf_counter() - started
+                yield item
+
+        outputs = iter(pipe(source()))
+        while True:
+            started = time.perf_counter()
+            waited_before = waited[0]
+            try:
+                output, url = next(outputs)
+            except StopIteration:
+                return
+            seconds = time.perf_counter() - started - (waited[0] - waited_before)
+            self.add(stage, "calls", 1, url)
+            self.add(stage, "seconds", seconds, url)
+            yield output, url
+
+    def export(self):
+        """
+        :return: the per-stage counters as plain dicts, e.g. to send them from a worker process
+        """
+        with self._lock:
+            return {stage: dict(counters) for stage, counters in self.stages.items()}
+
+    def merge(self, stages, page=None):
+        """
+        Add the counters exported by another process
+        :param stages: the dict returned by export()
+        :param page: the URL of the page they belong to
+        :return: void
+        """
+        for stage, counters in stages.items():
+            for name, value in counters.items():
+                self.add(stage, name, value, page)
+
+    def summary(self):
+        """
+        Print one row per stage with its calls, total and mean wall time and other counters
+        :return: void
+        """
+        print(f'================== METRICS ( {len(self.pages)} pages ) =================')
+        print(f"{'stage':<10} {'calls':>8} {'total s':>10} {'mean ms':>10}  counters")
+        for stage in STAGES + sorted(set(self.stages) - set(STAGES)):
+            if stage not in self.stages:
+                continue
+            counters = self.stages[stage]
+            calls, seconds = counters.get("calls", 0), counters.get("seconds", 0.0)
+            mean = 1000 * seconds / calls if calls else 0.0
+            others = ", ".join(f"{name} = {value:g}" for name, value in sorted(counters.items())
+                               if name not in ("calls", "seconds"))
+            print(f"{stage:<10} {calls:8g} {seconds:10.3f} {mean:10.2f}  {others}")
+
+    def write(self, path):
+        """
+        Write the per-stage and per-page counters as JSON
+        :param path: the output file
+        :return: void
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"stages": self.export(), "pages": {page: dict(counters) for page, counters in self.pages.items()}},
+                      f, indent=2)
+
+
+class Profiler:
+    """
+    Optional whole-run profiler: "cprofile" writes pstats data to a file (view it with python3 -m pstats or
+    snakeviz), "pyinstrument" prints a call tree and needs the pyinstrument package
+    """
+
+    def __init__(self, kind="cprofile", path="ise.prof"):
+        """
+        :param kind: "cprofile" or "pyinstrument"
+        :param path: the file the cProfile statistics are written to
+        """
+        if kind == "pyinstrument":
+            if pyinstrument is None:
+                raise ValueError("The pyinstrument profiler needs the pyinstrument package: pip3 install pyinstrument")
+            self.profiler = pyinstrument.Profiler()
+        elif kind == "cprofile":
+            import cProfile
+            self.profiler = cProfile.Profile()
+        else:
+            raise ValueError("Unknown profiler: " + kind)
+        self.kind = kind
+        self.path = path
+
+    def __enter__(self):
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+            print(self.profiler.output_text(unicode=True))
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path)
+            print(f"cProfile statistics written to {self.path}")
+        return False
+
+
+# Metrics shared by every part of the process
+metrics = Metrics()
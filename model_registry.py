@@ -0,0 +1,119 @@
+import threading
+import spacy
+from spanbert_backend import load_spanbert, BACKENDS, DEFAULT_BACKEND
+
+SPACY_MODEL = "en_core_web_lg"
+SPANBERT_DIR = "./pretrained_spanbert"
+# Pipeline components whose output is never read by the extraction; sentences come from the parser, entity labels
+# from ner and is_punct is a lexical attribute
+SPACY_EXCLUDE = ["tagger", "attribute_ruler", "lemmatizer"]
+
+
+class ModelRegistry:
+    """
+    Keeps the spaCy pipeline and the SpanBERT classifier resident in memory so that they are loaded from disk at most
+    once per process instead of once per web page. Models are loaded lazily the first time they are requested.
+    """
+
+    def __init__(self, spacy_model=SPACY_MODEL, spanbert_dir=SPANBERT_DIR, spacy_exclude=SPACY_EXCLUDE,
+                 spanbert_backend=DEFAULT_BACKEND):
+        self.spacy_model = spacy_model
+        self.spacy_exclude = list(spacy_exclude)
+        self.spanbert_dir = spanbert_dir
+        self.spanbert_backend = spanbert_backend
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, loader):
+        """
+        Return the model stored under name, calling loader to create it if it is not loaded yet
+        :param name: the registry key of the model
+        :param loader: a callable without arguments returning the loaded model
+        :return: the loaded model
+        """
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = loader()
+                    self._models[name] = model
+        return model
+
+    def get_nlp(self):
+        """
+        Return the spaCy pipeline without the excluded components, loading it on first use
+        :return: a spaCy Language object
+        """
+        return self._get("spacy", lambda: spacy.load(self.spacy_model, exclude=self.spacy_exclude))
+
+    def set_spacy_model(self, spacy_model, spacy_exclude=None):
+        """
+        Select the spaCy package to load, e.g. "en_core_web_sm" for speed. A different pipeline that is already
+        loaded is unloaded so that the next get_nlp() call picks up the new one
+        :param spacy_model: the name of an installed spaCy pipeline package
+        :param spacy_exclude: the components to exclude, or None to keep the current list
+        :return: void
+        """
+        if spacy_exclude is not None and list(spacy_exclude) != self.spacy_exclude:
+            self.spacy_exclude = list(spacy_exclude)
+            self.unload("spacy")
+        if spacy_model != self.spacy_model:
+            self.spacy_model = spacy_model
+            self.unload("spacy")
+
+    def set_spanbert_backend(self, backend):
+        """
+        Select the inference backend of SpanBERT, e.g. "int8" or "onnx" for faster CPU inference. A classifier already
+        loaded with another backend is unloaded
+        :param backend: one of spanbert_backend.BACKENDS
+        :return: void
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown SpanBERT backend: {backend} (expected one of {', '.join(BACKENDS)})")
+        if backend != self.spanbert_backend:
+            self.spanbert_backend = backend
+            self.unload("spanbert")
+
+    def get_spanbert(self):
+        """
+        Return the pre-trained SpanBERT relation classifier, loading it with the selected backend on first use
+        :return: a SpanBERT object
+        """
+        return self._get("spanbert", lambda: load_spanbert(self.spanbert_dir, self.spanbert_backend))
+
+    def is_loaded(self, name):
+        """
+        Check whether a model is currently resident
+        :param name: "spacy" or "spanbert"
+        :return: True if the model is loaded
+        """
+        return name in self._models
+
+    def warm_up(self, method="-spanbert"):
+        """
+        Load every model needed by the given extraction method ahead of the first request, so that a long-lived
+        process does not pay the loading cost while serving its first seed query
+        :param method: "-spanbert" or "-gpt3"
+        :return: void
+        """
+        self.get_nlp()
+        if method == "-spanbert":
+            self.get_spanbert()
+
+    def unload(self, name=None):
+        """
+        Drop a model (or all models if name is None) so that its memory can be reclaimed; it will be loaded again
+        on the next request
+        :param name: "spacy", "spanbert" or None
+        :return: void
+        """
+        with self._lock:
+            if name is None:
+                self._models.clear()
+            else:
+                self._models.pop(name, None)
+
+
+# Registry shared by every ISE instance of the process
+registry = ModelRegistry()
@@ -1,8 +1,13 @@
 import spacy
+from bisect import bisect_right
 from collections import defaultdict
 from spanbert import special_tokens
 import openai
 import ast
+from gpt_engine import GPTEngine
+from metrics import metrics
+from dedup import sentence_key
+from sentence_memo import spanbert_key
 
 spacy2bert = {
     "ORG": "ORGANIZATION",
@@ -22,6 +27,13 @@ bert2spacy = {
     "DATE": "DATE"
 }
 
+# Number of sentences seen and skipped by candidate_sentences, and of candidate sentences skipped by
+# skip_seen_sentences, over the whole run
+prefilter_stats = defaultdict(int)
+
+# GPTEngine used by extract_relations_gpt when the caller does not pass one, created on first use
+default_gpt_engine = None
+
 
 def get_entities(sentence):
     """
@@ -32,7 +44,109 @@ def get_entities(sentence):
     return [(e.text, spacy2bert[e.label_]) for e in sentence.ents if e.label_ in spacy2bert]
 
 
-def extract_relations_spbt(doc, spanbert, entities_of_interest=None, conf=0.7, target_relation='no_relation'):
+def candidate_sentences(doc, entities_of_interest=None):
+    """
+    Selects the sentences holding at least one subject-type and one object-type entity, using the doc-level entity
+    spans so that no sentence is scanned token by token. As in extract_relations_gpt, the first entity type of
+    entities_of_interest is the subject type and the others are object types
+    :param doc: The spaCy document to filter
+    :param entities_of_interest: A list of entity types, or None to keep every sentence
+    :return: A list of (sentence, labels, ents) tuples, labels being the set of spaCy entity labels of interest in the
+    sentence and ents the entities of interest lying completely within it (as Span.ents, without rescanning doc.ents)
+    """
+    sentences = list(doc.sents)
+    prefilter_stats["sentences"] += len(sentences)
+    subject_labels = object_labels = None
+    if entities_of_interest is not None:
+        subject_labels = {bert2spacy[entities_of_interest[0]]}
+        object_labels = {bert2spacy[b] for b in entities_of_interest[1:]}
+
+    starts = [sentence.start for sentence in sentences]
+    labels = defaultdict(set)
+    ents = defaultdict(list)
+    for ent in doc.ents:
+        if subject_labels is not None and ent.label_ not in subject_labels and ent.label_ not in object_labels:
+            continue
+        first = bisect_right(starts, ent.start) - 1
+        last = bisect_right(starts, ent.end - 1) - 1
+        for i in range(first, last + 1):
+            labels[i].add(ent.label_)
+        if first == last:
+            ents[first].append(ent)
+
+    if subject_labels is None:
+        return [(sentences[i], labels[i], ents[i]) for i in range(len(sentences))]
+    candidates = [(sentences[i], labels[i], ents[i]) for i in sorted(labels)
+                  if labels[i] & subject_labels and labels[i] & object_labels]
+    prefilter_stats["skipped"] += len(sentences) - len(candidates)
+    return candidates
+
+
+def skip_seen_sentences(candidates, seen_sentences, stats=None):
+    """
+    Drops the candidate sentences already run through the extraction model on an earlier page or earlier in the same
+    page, and records the others as seen. Their relations are already in X, so running them again adds nothing
+    :param candidates: The list returned by candidate_sentences
+    :param seen_sentences: A set of sentence_key() values, updated in place
+    :param stats: An optional dictionary whose "duplicates" count is increased by the number of sentences dropped
+    :return: The candidates not seen before
+    """
+    kept = []
+    for candidate in candidates:
+        sentence, _, ents = candidate
+        key = sentence_key(sentence.text, [(ent.start - sentence.start, ent.end - sentence.start, ent.label_)
+                                           for ent in ents])
+        if key in seen_sentences:
+            continue
+        seen_sentences.add(key)
+        kept.append(candidate)
+    prefilter_stats["duplicates"] += len(candidates) - len(kept)
+    if stats is not None:
+        stats["duplicates"] = stats.get("duplicates", 0) + len(candidates) - len(kept)
+    metrics.add("dedup", "sentences", len(candidates) - len(kept))
+    return kept
+
+
+def create_spbt_examples(sentence, entities_of_interest=None, ents=None):
+    """
+    Builds the SpanBERT input examples of a spaCy Sentence, one per entity pair and direction allowed by special_tokens
+    :param sentence: The spaCy Sentence object to be analyzed
+    :param entities_of_interest: A list of entity types to extract relations between
+    :param ents: The entities of the sentence if already known, e.g. from candidate_sentences
+    :return: A list of dicts with the keys "tokens", "subj" and "obj"
+    """
+    examples = []
+    for ep in create_entity_pairs(sentence, entities_of_interest, ents=ents):
+        if "SUBJ=%s" % ep[1][1] in special_tokens and "OBJ=%s" % ep[2][1] in special_tokens:
+            examples.append({"tokens": ep[0], "subj": ep[1], "obj": ep[2]})
+        if "SUBJ=%s" % ep[2][1] in special_tokens and "OBJ=%s" % ep[1][1] in special_tokens:
+            examples.append({"tokens": ep[0], "subj": ep[2], "obj": ep[1]})
+    return examples
+
+
+def predict_batched(spanbert, examples, batch_size=32):
+    """
+    Runs SpanBERT over a list of examples in fixed-size batches. Examples are sorted by token length first so that each
+    batch holds inputs of similar length; the predictions are returned in the original order of the examples
+    :param spanbert: The pre-trained SpanBERT model to use for relation extraction
+    :param examples: A list of SpanBERT input examples
+    :param batch_size: The maximum number of examples passed to one spanbert.predict call
+    :return: A list of (relation, confidence) predictions aligned with examples
+    """
+    order = sorted(range(len(examples)), key=lambda i: len(examples[i]["tokens"]))
+    preds = [None] * len(examples)
+    for b in range(0, len(order), batch_size):
+        batch = order[b:b + batch_size]
+        with metrics.timer("spanbert"):
+            batch_preds = spanbert.predict([examples[i] for i in batch])
+        metrics.add("spanbert", "examples", len(batch))
+        for i, pred in zip(batch, batch_preds):
+            preds[i] = pred
+    return preds
+
+
+def extract_relations_spbt(doc, spanbert, entities_of_interest=None, conf=0.7, target_relation='no_relation',
+                           batch_size=32, sentences=None, seen_sentences=None, memo=None, stats=None):
     """
     Extracts relations between named entities in a given document using a pre-trained SpanBERT model
     :param doc: The document to extract relations from
@@ -40,6 +154,11 @@ def extract_relations_spbt(doc, spanbert, entities_of_interest=None, conf=0.7, t
     :param entities_of_interest: A list of entity types to extract relations between. If not specified, all entity types will be used
     :param conf: The confidence threshold to use for relation extraction
     :param target_relation: The type of relation to extract. If not specified, all relations will be extracted
+    :param batch_size: The number of examples, gathered across all sentences of the document, run through SpanBERT at once
+    :param sentences: An optional dictionary in which the text of the sentence each relation was extracted from is stored
+    :param seen_sentences: An optional set of the keys of the sentences already processed, which are skipped
+    :param memo: An optional SentenceMemo of SpanBERT predictions; sentences found in it are not run through SpanBERT
+    :param stats: An optional dictionary in which the number of sentences skipped as already processed is counted
     :return: A dictionary containing the extracted relations, with each relation represented as a tuple containing the subject, relation, and object
     """
     num_sentences = len([s for s in doc.sents])
@@ -48,22 +167,47 @@ def extract_relations_spbt(doc, spanbert, entities_of_interest=None, conf=0.7, t
     res = defaultdict(int)
     count = 1
     annot_count = 0
-    for sentence in doc.sents:
+    sentence_examples = []
+    example_sentences = []
+    candidates = candidate_sentences(doc, entities_of_interest)
+    metrics.add("pairs", "sentences", num_sentences)
+    metrics.add("pairs", "candidate_sentences", len(candidates))
+    print(f"\tSkipped {num_sentences - len(candidates)} sentences without the right pair of named entity types")
+    if seen_sentences is not None:
+        count_before = len(candidates)
+        candidates = skip_seen_sentences(candidates, seen_sentences, stats)
+        print(f"\tSkipped {count_before - len(candidates)} sentences already processed")
+    for sentence, _, ents in candidates:
         if count % 5 == 0:
-            print(f"\tProcessed {count} / {num_sentences} sentences")
+            print(f"\tProcessed {count} / {len(candidates)} candidate sentences")
         count += 1
-        entity_pairs = create_entity_pairs(sentence, entities_of_interest)
-        examples = []
-        if len(entity_pairs) == 0:
-            continue
-        for ep in entity_pairs:
-            if "SUBJ=%s" % ep[1][1] in special_tokens and "OBJ=%s" % ep[2][1] in special_tokens:
-                examples.append({"tokens": ep[0], "subj": ep[1], "obj": ep[2]})
-            if "SUBJ=%s" % ep[2][1] in special_tokens and "OBJ=%s" % ep[1][1] in special_tokens:
-                examples.append({"tokens": ep[0], "subj": ep[2], "obj": ep[1]})
+        with metrics.timer("pairs"):
+            examples = create_spbt_examples(sentence, entities_of_interest, ents)
+        metrics.add("pairs", "examples", len(examples))
         if len(examples) == 0:
             continue
-        preds = spanbert.predict(examples)
+        sentence_examples.append(examples)
+        example_sentences.append(sentence)
+
+    # Predictions of the sentences already seen come from the memo; the examples of all other sentences are run
+    # through SpanBERT together, then the predictions are routed back per sentence
+    sentence_preds = [None] * len(sentence_examples)
+    keys = [None] * len(sentence_examples)
+    if memo is not None:
+        model = "spanbert-" + getattr(spanbert, "backend", "fp32")
+        for i, examples in enumerate(sentence_examples):
+            keys[i] = spanbert_key(model, examples)
+            sentence_preds[i] = memo.get(keys[i])
+    missing = [i for i in range(len(sentence_examples)) if sentence_preds[i] is None]
+    all_preds = predict_batched(spanbert, [ex for i in missing for ex in sentence_examples[i]], batch_size)
+    offset = 0
+    for i in missing:
+        preds = all_preds[offset:offset + len(sentence_examples[i])]
+        offset += len(sentence_examples[i])
+        sentence_preds[i] = [[relation, float(confidence)] for relation, confidence in preds]
+        if memo is not None:
+            memo.set(keys[i], sentence_preds[i])
+    for sentence, examples, preds in zip(example_sentences, sentence_examples, sentence_preds):
 
         for ex, pred in list(zip(examples, preds)):
             relation = pred[0]
@@ -86,6 +230,8 @@ def extract_relations_spbt(doc, spanbert, entities_of_interest=None, conf=0.7, t
             if confidence > conf:
                 if res[(subj, relation, obj)] < confidence:
                     res[(subj, relation, obj)] = confidence
+                    if sentences is not None:
+                        sentences[(subj, relation, obj)] = sentence.text
                     print("\t\tAdding to set of extracted relations")
                 else:
                     print("\t\tDuplicate with lower confidence than existing record. Ignoring this.")
@@ -97,163 +243,180 @@ def extract_relations_spbt(doc, spanbert, entities_of_interest=None, conf=0.7, t
     return res
 
 
-def extract_relations_gpt(doc, openai, entities_of_interest=None, target_relation='no_relation'):
+def build_gpt_prompt(sentence, entities_of_interest, target_relation):
+    """
+    Builds the GPT-3 prompt asking for all instances of the target relation in a sentence
+    :param sentence: The text of the sentence (or of several packed sentences)
+    :param entities_of_interest: A list of entity types; the first one is the subject type, the second the object type
+    :param target_relation: The name of the relation to extract
+    :return: The prompt text
+    """
+    return """ Given a sentence, extract all the instances of the following relationship as possible:
+                    relationship type: {}
+                    output [Subject: {}, relationship type, Object: {}]
+                    example output for all possible relationships:["Jeff Bezos", "Schools_Attended", "Princeton University"], 
+                    ["Alec Radford", "Work_For", "OpenAI"], ["Mariah Carey", "Live_In", "New York City"], 
+                    ["Jensen Huang", "Top_Member_Employees", "Nvidia"] 
+                    sentence: {}  your answer must be a list and all elements types in the list must be string!"""\
+        .format(target_relation, entities_of_interest[0], entities_of_interest[1], sentence)
+
+
+def extract_relations_gpt(doc, openai, entities_of_interest=None, target_relation='no_relation', engine=None,
+                          sentences=None, seen_sentences=None, stats=None):
     """
     Extracts relations between named entities in a given document using OpenAI's GPT-3 language model
     :param doc: The document to extract relations from
     :param openai: The OpenAI API object to use for relation extraction
     :param entities_of_interest: A list of entity types to extract relations between. If not specified, all entity types will be used
     :param target_relation: The type of relation to extract. If not specified, all relations will be extracted
+    :param engine: The GPTEngine sending the prompts; if not specified, one engine wrapping openai is created on the first call and shared by the later ones
+    :param sentences: An optional dictionary in which the text of the sentence each relation was extracted from is stored
+    :param seen_sentences: An optional set of the keys of the sentences already processed, which are skipped
+    :param stats: An optional dictionary in which the number of sentences skipped as already processed is counted
     :return: A dictionary containing the extracted relations, with each relation represented as a tuple containing the subject, relation, and object.
     """
+    global default_gpt_engine
+    if engine is None:
+        if default_gpt_engine is None:
+            default_gpt_engine = GPTEngine(openai)
+        engine = default_gpt_engine
     num_sentences = len([s for s in doc.sents])
     print("\tExtracted {} sentences. Processing each sentence one by one to check for presence of right pair of named "
           "entity types; if so, will run the second pipeline ...".format(num_sentences))
     res = defaultdict(int)
     count = 1
     annot_count = 0
-    for sentence in doc.sents:
+    # One (sentence, prompt) item per sentence and object type holding the right pair of named entity types
+    items = []
+    candidates = candidate_sentences(doc, entities_of_interest)
+    print(f"\tSkipped {num_sentences - len(candidates)} sentences without the right pair of named entity types")
+    if seen_sentences is not None:
+        count_before = len(candidates)
+        candidates = skip_seen_sentences(candidates, seen_sentences, stats)
+        print(f"\tSkipped {count_before - len(candidates)} sentences already processed")
+    for sentence, etypes, _ in candidates:
         if count % 5 == 0:
-            print(f"\tProcessed {count} / {num_sentences} sentences")
+            print(f"\tProcessed {count} / {len(candidates)} candidate sentences")
         count += 1
-        etypes = [s.ent_type_ for s in sentence]
         for ent in entities_of_interest[1:]:
             if bert2spacy[entities_of_interest[0]] in etypes and bert2spacy[ent] in etypes:
-                prompt_text = """ Given a sentence, extract all the instances of the following relationship as possible:
-                    relationship type: {}
-                    output [Subject: {}, relationship type, Object: {}]
-                    example output for all possible relationships:["Jeff Bezos", "Schools_Attended", "Princeton University"], 
-                    ["Alec Radford", "Work_For", "OpenAI"], ["Mariah Carey", "Live_In", "New York City"], 
-                    ["Jensen Huang", "Top_Member_Employees", "Nvidia"] 
-                    sentence: {}  your answer must be a list and all elements types in the list must be string!"""\
-                    .format(target_relation, entities_of_interest[0], entities_of_interest[1], sentence)
-
-                model = 'text-davinci-003'
-                max_tokens = 100
-                temperature = 0.1
-                top_p = 1
-                frequency_penalty = 0
-                presence_penalty = 0
-
-                response_text = get_openai_completion(prompt_text, model, max_tokens, temperature, top_p,
-                                                      frequency_penalty, presence_penalty)
-
-                if len(response_text) != 0:
-                    response_text = response_text[response_text.find("["):]
-                    try:
-                        response_text = ast.literal_eval(response_text)
-                    except:
-                        pass
-                    for result in response_text:
-                        if len(result) == 3:
-                            if result[1] == target_relation:
-                                annot_count += 1
-                                break
-                    for result in response_text:
-                        if len(result) == 3:
-                            print("\n\t\t=== Extracted Relation ===")
-                            print("\t\tSentence: {}".format(sentence))
-                            print("\t\tSubject: {} ; Object: {} ;".format(result[0], result[2]))
-                            subj = result[0]
-                            obj = result[2]
-                            if res[(subj, result[1], obj)] == 0:
-                                res[(subj, result[1], obj)] = 1
-                                print("\t\tAdding to set of extracted relations.")
-                            else:
-                                print("\t\tDuplicate. Ignoring this.")
-                            print("\t\t==========")
+                # Normalized whitespace lets the same sentence laid out differently share one memoized response
+                items.append(" ".join(sentence.text.split()))
+    if engine.sentences_per_prompt > 1:
+        # Pack distinct consecutive sentences into one prompt; annotations are then counted per packed group
+        unique = list(dict.fromkeys(items))
+        items = [" ".join(unique[i:i + engine.sentences_per_prompt])
+                 for i in range(0, len(unique), engine.sentences_per_prompt)]
+
+    metrics.add("gpt", "sentences", num_sentences)
+    metrics.add("gpt", "candidate_sentences", len(candidates))
+    metrics.add("gpt", "prompts", len(items))
+    with metrics.timer("gpt"):
+        responses = engine.complete_all([build_gpt_prompt(item, entities_of_interest, target_relation)
+                                         for item in items])
+
+    for sentence, response_text in zip(items, responses):
+        if len(response_text) != 0:
+            response_text = response_text[response_text.find("["):]
+            try:
+                response_text = ast.literal_eval(response_text)
+            except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+                print("\t\tUnable to parse the GPT-3 response. Ignoring it.")
+                continue
+            if not isinstance(response_text, (list, tuple)):
+                continue
+            response_text = [result for result in response_text if isinstance(result, (list, tuple))]
+            for result in response_text:
+                if len(result) == 3:
+                    if result[1] == target_relation:
+                        annot_count += 1
+                        break
+            for result in response_text:
+                if len(result) == 3:
+                    print("\n\t\t=== Extracted Relation ===")
+                    print("\t\tSentence: {}".format(sentence))
+                    print("\t\tSubject: {} ; Object: {} ;".format(result[0], result[2]))
+                    subj = result[0]
+                    obj = result[2]
+                    if res[(subj, result[1], obj)] == 0:
+                        res[(subj, result[1], obj)] = 1
+                        if sentences is not None:
+                            sentences[(subj, result[1], obj)] = sentence
+                        print("\t\tAdding to set of extracted relations.")
+                    else:
+                        print("\t\tDuplicate. Ignoring this.")
+                    print("\t\t==========")
     print(f"\tExtracted annotations for  {annot_count}  out of total  {num_sentences}  sentences")
 
     return res
 
 
-def get_openai_completion(prompt, model, max_tokens, temperature = 0.2, top_p = 1, frequency_penalty = 0, presence_penalty =0):
-    """
-    Uses the OpenAI API to generate text completion based on the given prompt and parameters
-    :param prompt: The text prompt to be used for the text generation
-    :param model: The name of the OpenAI model to be used for the text generation
-    :param max_tokens: The maximum number of tokens to be generated by the API
-    :param temperature: A value controlling the randomness of the generated text
-    :param top_p: A value controlling the diversity of the generated text
-    :param frequency_penalty: A value controlling the repetition of the generated text
-    :param presence_penalty: A value controlling the presence of certain words in the generated text
-    :return: The generated text completion
+def create_entity_pairs(sents_doc, entities_of_interest, window_size=40, ents=None):
     """
-    response = openai.Completion.create(
-        model=model,
-        prompt=prompt,
-        max_tokens=max_tokens,
-        temperature=temperature,
-        top_p=top_p,
-        frequency_penalty=frequency_penalty,
-        presence_penalty=presence_penalty
-    )
-    response_text = response['choices'][0]['text']
-    return response_text
-
-def create_entity_pairs(sents_doc, entities_of_interest, window_size=40):
-    """
-    Extracts entity pairs from a spaCy Sentence object based on the given entities of interest and window size
+    Extracts entity pairs from a spaCy Sentence object based on the given entities of interest and window size.
+    The punctuation boundaries around every token are computed once per sentence, and since entities are sorted the
+    inner loop stops as soon as the next entity falls outside the window
     :param sents_doc: A spaCy Sentence object to be analyzed
     :param entities_of_interest: A list of entities of interest to be extracted from the Sentence object
     :param window_size: The maximum window size to be used for entity pair extraction
+    :param ents: The entities of the Sentence if already known; sents_doc.ents rescans every entity of the document
     :return: A list of extracted entity pairs in the format (text, entity1, entity2)
     """
     if entities_of_interest is not None:
         entities_of_interest = {bert2spacy[b] for b in entities_of_interest}
-    ents = sents_doc.ents  # get entities for given sentence
-    length_doc = len(sents_doc)
+    if ents is None:
+        ents = sents_doc.ents
+    ents = [e for e in ents if entities_of_interest is None or e.label_ in entities_of_interest]
     entity_pairs = []
+    if len(ents) < 2:
+        return entity_pairs
+
+    offset = sents_doc.start
+    length_doc = len(sents_doc)
+    texts = [token.text for token in sents_doc]
+    # prev_punc[i]: last punctuation index <= i (or -1); next_punc[i]: first punctuation index >= i (or length_doc)
+    prev_punc = [-1] * length_doc
+    next_punc = [length_doc] * (length_doc + 1)
+    last = -1
+    for i, token in enumerate(sents_doc):
+        if token.is_punct:
+            last = i
+        prev_punc[i] = last
+    for i in range(length_doc - 1, -1, -1):
+        next_punc[i] = i if prev_punc[i] == i else next_punc[i + 1]
+    lowered = [e.text.lower() for e in ents]
+
     for i in range(len(ents)):
         e1 = ents[i]
-        if entities_of_interest is not None and e1.label_ not in entities_of_interest:
-            continue
+        # Left context starts after the closest punctuation before e1 (kept at 0 near the sentence start)
+        start = e1.start - 1 - offset
+        left_r = 0
+        if start > 0 and prev_punc[start] >= 2:
+            left_r = prev_punc[start] + 1
 
-        for j in range(1, len(ents) - i):
-            e2 = ents[i + j]
-            if entities_of_interest is not None and e2.label_ not in entities_of_interest:
+        for j in range(i + 1, len(ents)):
+            e2 = ents[j]
+            if e2.start - e1.end > window_size:
+                break
+            if lowered[i] == lowered[j]:  # make sure e1 != e2
                 continue
-            if e1.text.lower() == e2.text.lower():  # make sure e1 != e2
+            if e2.start - e1.end < 1:
                 continue
 
-            if (1 <= (e2.start - e1.end) <= window_size):
-
-                punc_token = False
-                start = e1.start - 1 - sents_doc.start
-                if start > 0:
-                    while not punc_token:
-                        punc_token = sents_doc[start].is_punct
-                        start -= 1
-                        if start < 0:
-                            break
-                    left_r = start + 2 if start > 0 else 0
-                else:
-                    left_r = 0
-
-                # Find end of sentence
-                punc_token = False
-                start = e2.end - sents_doc.start
-                if start < length_doc:
-                    while not punc_token:
-                        punc_token = sents_doc[start].is_punct
-                        start += 1
-                        if start == length_doc:
-                            break
-                    right_r = start if start < length_doc else length_doc
-                else:
-                    right_r = length_doc
-
-                if (right_r - left_r) > window_size:  # sentence should not be longer than window_size
-                    continue
-
-                x = [token.text for token in sents_doc[left_r:right_r]]
-                gap = sents_doc.start + left_r
-                e1_info = (e1.text, spacy2bert[e1.label_], (e1.start - gap, e1.end - gap - 1))
-                e2_info = (e2.text, spacy2bert[e2.label_], (e2.start - gap, e2.end - gap - 1))
-                if e1.start == e1.end:
-                    assert x[e1.start - gap] == e1.text, "{}, {}".format(e1_info, x)
-                if e2.start == e2.end:
-                    assert x[e2.start - gap] == e2.text, "{}, {}".format(e2_info, x)
-                entity_pairs.append((x, e1_info, e2_info))
-    return entity_pairs
+            # Right context ends with the closest punctuation after e2
+            start = e2.end - offset
+            right_r = min(next_punc[start] + 1, length_doc) if start < length_doc else length_doc
+
+            if (right_r - left_r) > window_size:  # sentence should not be longer than window_size
+                break  # right_r only grows with e2
 
+            x = texts[left_r:right_r]
+            gap = offset + left_r
+            e1_info = (e1.text, spacy2bert[e1.label_], (e1.start - gap, e1.end - gap - 1))
+            e2_info = (e2.text, spacy2bert[e2.label_], (e2.start - gap, e2.end - gap - 1))
+            if e1.start == e1.end:
+                assert x[e1.start - gap] == e1.text, "{}, {}".format(e1_info, x)
+            if e2.start == e2.end:
+                assert x[e2.start - gap] == e2.text, "{}, {}".format(e2_info, x)
+            entity_pairs.append((x, e1_info, e2_info))
+    return entity_pairs
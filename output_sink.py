@@ -0,0 +1,166 @@
+import glob
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of every output record: "tuple" records hold an accepted tuple, and a "page" record, with only the url,
+# iteration and query set, marks the end of the records of a processed web page
+FIELDS = ["type", "subject", "relation", "object", "confidence", "url", "sentence", "iteration", "query"]
+DEFAULT_FLUSH_EVERY = 100
+
+
+class JsonlSink:
+    """
+    Writes accepted tuples to a JSON Lines file, one record per line. The tuples of a web page are held back until the
+    page is complete, then buffered with the "page" record marking its end; the buffer is written and synced to disk
+    once it holds flush_every records, always at a page boundary, so a crash never leaves part of a page in the file.
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY, resume=False):
+        """
+        :param path: the output file
+        :param flush_every: the number of records buffered before they are written
+        :param resume: whether records are appended to an existing file; otherwise the file is truncated
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.page = []
+        self.buffer = []
+        self.written = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file = open(path, "a+b" if resume else "w+b")
+        # Drop a partial last line left by a crash so that appended records start on a line of their own
+        self.file.seek(0)
+        end = self.file.read().rfind(b"\n") + 1
+        self.file.truncate(end)
+
+    def write(self, record):
+        """
+        Hold one tuple record until the end of its web page
+        :param record: a dict with the FIELDS keys
+        :return: void
+        """
+        self.page.append(dict({"type": "tuple"}, **record))
+
+    def end_page(self, url, iteration, query, sync=False):
+        """
+        Buffer the tuples of a completed web page followed by its "page" record, writing the buffer out once it holds
+        flush_every records
+        :param url: the URL of the web page
+        :param iteration: the iteration it was processed in
+        :param query: the query of that iteration
+        :param sync: whether to write and sync the buffer right away, e.g. before the page is checkpointed
+        :return: void
+        """
+        self.buffer.extend(self.page)
+        self.buffer.append({"type": "page", "url": url, "iteration": iteration, "query": query})
+        self.page = []
+        if sync or len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records of completed pages and sync the file to disk
+        :return: void
+        """
+        if not self.buffer:
+            return
+        self.file.write("".join(json.dumps(record, ensure_ascii=False) + "\n"
+                                for record in self.buffer).encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        # The tuples of a page interrupted before its end are dropped; the page is processed again on resume
+        self.flush()
+        self.file.close()
+
+
+class ParquetSink(JsonlSink):
+    """
+    Writes accepted tuples as a Parquet dataset: a folder in which every flush adds one part file. A Parquet file is
+    only readable once its footer is written, so parts keep every flushed record readable after a crash; the folder
+    loads as one table with pyarrow.parquet.read_table or pandas.read_parquet.
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY, resume=False):
+        if pyarrow is None:
+            raise ValueError("Parquet output needs the pyarrow package: pip3 install pyarrow")
+        self.path = path
+        self.flush_every = flush_every
+        self.page = []
+        self.buffer = []
+        self.written = 0
+        os.makedirs(path, exist_ok=True)
+        parts = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+        if not resume:
+            for part in parts:
+                os.remove(part)
+            parts = []
+        self.parts = len(parts)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        # Explicit types, as "page" records leave the tuple columns empty
+        table = pyarrow.Table.from_pylist(self.buffer, schema=pyarrow.schema(
+            [("type", pyarrow.string()), ("subject", pyarrow.string()), ("relation", pyarrow.string()),
+             ("object", pyarrow.string()), ("confidence", pyarrow.float64()), ("url", pyarrow.string()),
+             ("sentence", pyarrow.string()), ("iteration", pyarrow.int64()), ("query", pyarrow.string())]))
+        part = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+        # Written under a temporary name first so that a part file is either complete or absent
+        pyarrow.parquet.write_table(table, part + ".tmp")
+        with open(part + ".tmp", "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(part + ".tmp", part)
+        self.parts += 1
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+
+def open_sink(path, flush_every=DEFAULT_FLUSH_EVERY, resume=False):
+    """
+    Create the sink matching the extension of path
+    :param path: a .jsonl file or a .parquet folder
+    :param flush_every: the number of records buffered before they are written
+    :param resume: whether to keep the records of a previous run and append to them
+    :return: a JsonlSink or a ParquetSink
+    """
+    if path.endswith(".parquet"):
+        return ParquetSink(path, flush_every, resume)
+    return JsonlSink(path, flush_every, resume)
+
+
+def load_records(path):
+    """
+    Read the records of a previous run, e.g. to resume it. A truncated last line left by a crash is ignored
+    :param path: a .jsonl file or a .parquet folder written by a sink
+    :return: a list of record dicts in the order they were written; empty if path does not exist
+    """
+    if not os.path.exists(path):
+        return []
+    if path.endswith(".parquet"):
+        if pyarrow is None:
+            raise ValueError("Parquet output needs the pyarrow package: pip3 install pyarrow")
+        parts = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+        return [record for part in parts for record in pyarrow.parquet.read_table(part).to_pylist()]
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
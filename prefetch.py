@@ -0,0 +1,140 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Speculative searches allowed per iteration; each one is a Custom Search API request, wasted if the next iteration
+# uses another query
+DEFAULT_MAX_SEARCHES = 1
+
+
+class Speculation:
+    """
+    The search and page downloads started for one predicted query
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.cancelled = threading.Event()
+        # Future of the (results, pages) of the speculation; pages maps the URL of every page download started to its
+        # future
+        self.future = None
+        self.pages = {}
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """
+        Stop the speculation: downloads not started yet are dropped, those in progress finish and only fill the cache
+        :return: void
+        """
+        with self._lock:
+            self.cancelled.set()
+            for future in self.pages.values():
+                future.cancel()
+
+
+class Prefetcher:
+    """
+    Speculative search and download of the pages of the next iteration. While the pages of an iteration are still
+    being extracted, the query most likely to come next (the one built from the current best unused tuple) is searched
+    and its new pages are downloaded in the background. If the next iteration uses that query, the search results and
+    the downloads are handed over; otherwise the speculation is cancelled and whatever it already finished is only kept
+    in the cache, when enabled. At most max_searches speculations are started per iteration.
+    """
+
+    def __init__(self, search, fetcher, sink_factory, url_key, cache=None, max_searches=DEFAULT_MAX_SEARCHES):
+        """
+        :param search: a callable returning the search results of a query, e.g. ISE.google_search
+        :param fetcher: the PageFetcher used to download the pages
+        :param sink_factory: a callable creating the HTMLTextExtractor of a page, see PageFetcher.fetch
+        :param url_key: a callable returning the key of a URL in seen_URLs
+        :param cache: an optional Cache in which the text of every downloaded page is stored
+        :param max_searches: the number of speculative searches allowed per iteration, i.e. between two claim() calls
+        """
+        self.search = search
+        self.fetcher = fetcher
+        self.sink_factory = sink_factory
+        self.url_key = url_key
+        self.cache = cache
+        # One speculation runs at a time: its search, then the submission of its downloads to the fetcher
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.current = None
+        self.max_searches = max_searches
+        self.searches = 0
+        # Speculative "searches" and "pages" started, and those "used" by the next iteration
+        self.stats = defaultdict(int)
+
+    def speculate(self, query, seen_keys):
+        """
+        Start searching and downloading the pages of a predicted query, cancelling the previous speculation if it was
+        for another query. Nothing is done once max_searches speculations were started in this iteration
+        :param query: the predicted query of the next iteration
+        :param seen_keys: the keys of the URLs already seen, whose pages are not downloaded
+        :return: void
+        """
+        if (self.current is not None and self.current.query == query) or self.searches >= self.max_searches:
+            return
+        self.searches += 1
+        self.cancel()
+        self.current = Speculation(query)
+        self.current.future = self.executor.submit(self._run, self.current, seen_keys)
+        self.stats["searches"] += 1
+
+    def _run(self, speculation, seen_keys):
+        results = self.search(speculation.query)
+        with speculation._lock:
+            if speculation.cancelled.is_set():
+                return results, {}
+            for result in results:
+                url = result["URL"]
+                if self.url_key(url) in seen_keys or url in speculation.pages:
+                    continue
+                if self.cache is not None and self.cache.contains("page", url):
+                    continue
+                speculation.pages[url] = self.fetcher.executor.submit(self._download, url)
+            self.stats["pages"] += len(speculation.pages)
+        return results, speculation.pages
+
+    def _download(self, url):
+        sink = self.fetcher.fetch(url, self.sink_factory())
+        if self.cache is not None:
+            self.cache.set("page", url, sink.text)
+        return sink
+
+    def claim(self, query):
+        """
+        Take over the speculation of the query of a new iteration, waiting for its search to finish
+        :param query: the query of the iteration
+        :return: a (results, pages) tuple, pages mapping URLs to the futures of their downloads, or None if the
+        speculation was for another query or its search failed; the iteration then searches as usual
+        """
+        speculation = self.current
+        self.searches = 0
+        if speculation is None or speculation.query != query:
+            self.cancel()
+            return None
+        self.current = None
+        try:
+            results, pages = speculation.future.result()
+        except Exception:
+            # The iteration searches again and reports the error itself
+            return None
+        self.stats["used"] += 1
+        self.stats["pages_used"] += len(pages)
+        return results, pages
+
+    def cancel(self):
+        """
+        Cancel the current speculation, if any
+        :return: void
+        """
+        if self.current is not None:
+            self.current.cancel()
+            self.current = None
+
+    def close(self):
+        """
+        Cancel the current speculation and stop the background thread
+        :return: void
+        """
+        self.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,107 @@
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from cache import content_key
+
+# Default memory budget of one memo
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Rough number of bytes taken by the Python objects of an entry, besides three bytes per character of its JSON
+ENTRY_OVERHEAD = 200
+
+# Lookups of every memo of the process: "hits" in memory, "disk_hits", "misses" and LRU "evictions"
+memo_stats = defaultdict(int)
+_stats_lock = threading.Lock()
+
+
+def spanbert_key(model, examples):
+    """
+    Key of the SpanBERT predictions of one sentence: its tokens and entity pair spans fully determine them
+    :param model: the name of the model and backend, e.g. "spanbert-fp32"
+    :param examples: the SpanBERT examples of the sentence, as built by create_spbt_examples
+    :return: a hex SHA-256 key
+    """
+    return content_key(model, json.dumps([[ex["tokens"], ex["subj"], ex["obj"]] for ex in examples]))
+
+
+class SentenceMemo:
+    """
+    Memo of model outputs per sentence: an in-process LRU dictionary bounded by an approximate number of bytes, in
+    front of the on-disk Cache when one is given. Values must be JSON-serializable, as they are also persisted.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache=None, namespace="sentence"):
+        """
+        :param max_bytes: the approximate memory budget of the in-process entries; 0 keeps nothing in memory
+        :param cache: an optional Cache in which the entries are also stored
+        :param namespace: the namespace of the entries in the cache
+        """
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.namespace = namespace
+        # key -> (value, size), least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Look up a value, in memory first and then on disk
+        :param key: the key of the value
+        :return: the value, or None if it is not memoized
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self._count("hits")
+                return entry[0]
+        value = self.cache.get(self.namespace, key) if self.cache is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                self._count("misses")
+                return None
+            self.disk_hits += 1
+            self._count("disk_hits")
+            self._store(key, value)
+        return value
+
+    def set(self, key, value):
+        """
+        Memoize a value in memory, evicting the least recently used entries beyond the budget, and on disk
+        :param key: the key of the value
+        :param value: a JSON-serializable value
+        :return: void
+        """
+        with self._lock:
+            self._store(key, value)
+        if self.cache is not None:
+            self.cache.set(self.namespace, key, value)
+
+    def _store(self, key, value):
+        size = len(key) + 3 * len(json.dumps(value)) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+            self._count("evictions")
+
+    @staticmethod
+    def _count(name):
+        with _stats_lock:
+            memo_stats[name] += 1
@@ -0,0 +1,231 @@
+import json
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from model_registry import registry
+from fetcher import PageFetcher
+from extraction_pool import ExtractionPool
+from cache import Cache, DEFAULT_CACHE_PATH, DEFAULT_TTL
+from ise import ISE
+from prefetch import DEFAULT_MAX_SEARCHES
+
+# Number of jobs expanded at the same time, and of extraction processes shared by all jobs
+DEFAULT_JOBS = 4
+DEFAULT_WORKERS = 2
+
+
+class JobConsole:
+    """
+    Stands in for sys.stdout while the service runs: everything a job prints goes to the stream of the thread running
+    it, and output printed outside a job is discarded. With --log, every line of a job is written to stderr with the
+    job id in front of it.
+    """
+
+    def __init__(self, log=False):
+        self.log = log
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self, job_id):
+        self._local.job_id = job_id
+        self._local.line = ""
+
+    def stop(self):
+        self.flush()
+        self._local.job_id = None
+
+    def write(self, text):
+        if not self.log or getattr(self._local, "job_id", None) is None:
+            return len(text)
+        lines = (self._local.line + text).split("\n")
+        self._local.line = lines.pop()
+        if lines:
+            with self._lock:
+                sys.stderr.write("".join(f"[{self._local.job_id}] {line}\n" for line in lines))
+        return len(text)
+
+    def flush(self):
+        if self.log and getattr(self._local, "job_id", None) is not None and self._local.line:
+            self.write("\n")
+
+
+class JobSink:
+    """
+    The output sink of one job: every tuple accepted by the job is sent to the client right away, tagged with the job
+    id. It has the write/close interface of the sinks in output_sink.py
+    """
+
+    def __init__(self, service, job_id):
+        self.service = service
+        self.job_id = job_id
+        self.written = 0
+
+    def write(self, record):
+        self.service.emit(dict({"job": self.job_id, "event": "tuple"}, **record))
+        self.written += 1
+
+    def end_page(self, url, iteration, query, sync=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class Service:
+    """
+    Long-running extraction service. The spaCy pipeline and SpanBERT classifier stay loaded in a shared pool of
+    extraction processes, the page fetcher and the cache are shared as well, and several jobs (method, relation,
+    threshold, query, k) are expanded at the same time. Each job runs on its own ISE instance, so its query, set X and
+    seen URLs are never shared with another job.
+    """
+
+    def __init__(self, google_api_key, google_engine_id, openai_key, options, out=sys.stdout):
+        """
+        :param google_api_key: the Google Custom Search Engine JSON API Key
+        :param google_engine_id: the Google Custom Search Engine ID
+        :param openai_key: the OpenAI secret key
+        :param options: the --name=value options of the command line
+        :param out: the stream the job events are written to, one JSON object per line
+        """
+        self.google_api_key = google_api_key
+        self.google_engine_id = google_engine_id
+        self.openai_key = openai_key
+        self.options = options
+        self.out = out
+        self._out_lock = threading.Lock()
+        self.batch_size = int(options.get("batch-size", 32))
+        self.html_backend = options.get("html-backend", "html.parser")
+        if "spacy-model" in options:
+            registry.set_spacy_model(options["spacy-model"])
+        if "spanbert-backend" in options:
+            registry.set_spanbert_backend(options["spanbert-backend"])
+        self.cache = None
+        if "no-cache" not in options:
+            self.cache = Cache(options.get("cache", DEFAULT_CACHE_PATH), int(options.get("cache-ttl", DEFAULT_TTL)))
+        self.fetcher = PageFetcher()
+        self.pool = ExtractionPool(int(options.get("workers", DEFAULT_WORKERS)), registry, ["-spanbert"],
+                                   self.batch_size, openai_key, int(options.get("gpt-workers", 4)),
+                                   float(options["gpt-rpm"]) if "gpt-rpm" in options else None,
+                                   int(options.get("gpt-pack", 1)),
+                                   int(float(options.get("memo-size", 64)) * 1024 * 1024), self.cache)
+        self.executor = ThreadPoolExecutor(max_workers=int(options.get("jobs", DEFAULT_JOBS)))
+        self.console = JobConsole("log" in options)
+
+    def emit(self, event):
+        """
+        Write one event to the client
+        :param event: a JSON-serializable dict
+        :return: void
+        """
+        line = json.dumps(event) + "\n"
+        with self._out_lock:
+            self.out.write(line)
+            self.out.flush()
+
+    def make_job(self, spec):
+        """
+        Build the ISE instance of a job, checking its parameters
+        :param spec: a dict with the id, method, relation, threshold, query and k of the job
+        :return: an ISE instance sharing the fetcher, cache and extraction pool of the service
+        """
+        job = ISE(registry, self.fetcher)
+        job.METHOD = spec.get("method", "-spanbert")
+        if not job.METHOD.startswith("-"):
+            job.METHOD = "-" + job.METHOD
+        if job.METHOD not in ("-spanbert", "-gpt3"):
+            raise ValueError("method must be spanbert or gpt3")
+        job.RELATION = int(spec["relation"])
+        if job.RELATION not in job.relation_map:
+            raise ValueError("relation must be between 1 and 4")
+        job.THRESHOLD = float(spec.get("threshold", 0.7 if job.METHOD == "-spanbert" else 0))
+        job.QUERY = spec["query"]
+        job.k = int(spec["k"])
+        job.GOOGLE_JSON_API_KEY = self.google_api_key
+        job.GOOGLE_ENGINE_ID = self.google_engine_id
+        job.OPENAI_KEY = self.openai_key
+        job.BATCH_SIZE = self.batch_size
+        job.HTML_BACKEND = self.html_backend
+        job.cache = self.cache
+        job.pool = self.pool
+        if "prefetch" in self.options:
+            job.enable_prefetch(int(self.options.get("prefetch-searches", DEFAULT_MAX_SEARCHES)))
+        return job
+
+    def run_job(self, job_id, spec):
+        """
+        Expand one job and report its outcome: a "done" event with its tuples, or an "error" event
+        :param job_id: the id of the job
+        :param spec: the job dict read from the input
+        :return: void
+        """
+        started = time.perf_counter()
+        self.console.start(job_id)
+        job = None
+        try:
+            job = self.make_job(spec)
+            job.sink = JobSink(self, job_id)
+            job.iterative_set_expansion()
+            self.emit({"job": job_id, "event": "done", "iterations": job.iteration,
+                       "tuples": [{"subject": tup[0], "relation": tup[1], "object": tup[2],
+                                   "confidence": float(confidence)} for tup, confidence in job.X.top()],
+                       "seconds": round(time.perf_counter() - started, 3)})
+        except Exception as e:
+            traceback.print_exc(file=self.console)
+            self.emit({"job": job_id, "event": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            if job is not None and job.prefetcher is not None:
+                job.prefetcher.close()
+            self.console.stop()
+
+    def serve(self, lines):
+        """
+        Schedule every job read from the input and wait for all of them to finish
+        :param lines: an iterable of JSON job lines, e.g. sys.stdin
+        :return: void
+        """
+        count = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            count += 1
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.emit({"job": None, "event": "error", "error": f"invalid job: {e}"})
+                continue
+            job_id = spec.get("id", count)
+            self.emit({"job": job_id, "event": "queued"})
+            self.executor.submit(self.run_job, job_id, spec)
+        self.executor.shutdown(wait=True)
+
+    def close(self):
+        """
+        Stop the extraction processes and release the fetcher and the cache
+        :return: void
+        """
+        self.pool.close()
+        self.fetcher.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+if __name__ == "__main__":
+    inputs = [arg for arg in sys.argv if not arg.startswith("--")]
+    options = dict((arg[2:].split("=", 1) + [""])[:2] for arg in sys.argv if arg.startswith("--"))
+    if len(inputs) < 4:
+        print("Please enter valid usage: python3 service.py <google api key> <google engine id> <openai secret key> "
+              "[--jobs=<n>] [--workers=<n>] [--log] [--batch-size=<n>] [--no-cache] [--cache=<path>] "
+              "[--cache-ttl=<seconds>] [--spacy-model=<name>] [--spanbert-backend=<name>] [--gpt-workers=<n>] "
+              "[--gpt-rpm=<n>] [--gpt-pack=<n>] [--html-backend=html.parser|lxml] [--memo-size=<MiB>] "
+              "[--prefetch] [--prefetch-searches=<n>]")
+        sys.exit(1)
+    service = Service(inputs[1], inputs[2], inputs[3], options, sys.stdout)
+    # Jobs print their progress like a command-line run; it must not mix with the events on stdout
+    sys.stdout = service.console
+    try:
+        service.serve(sys.stdin)
+    finally:
+        sys.stdout = service.out
+        service.close()
@@ -0,0 +1,170 @@
+import inspect
+import os
+from spanbert import SpanBERT
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# fp32: the PyTorch model as trained; int8: PyTorch with dynamically quantized Linear layers; onnx: the model
+# exported to ONNX and run by ONNX Runtime; onnx-int8: the ONNX model with dynamically quantized weights
+BACKENDS = ["fp32", "int8", "onnx", "onnx-int8"]
+DEFAULT_BACKEND = "fp32"
+# Where the exported model is kept; it is reused by later runs, delete it after changing the SpanBERT weights
+DEFAULT_ONNX_PATH = "./.ise_cache/spanbert.onnx"
+# Input run through the classifier once to record how predict() calls it, so that it can be traced for the export
+SAMPLE_EXAMPLE = {"tokens": ["Bill", "Gates", "works", "for", "Microsoft", "."],
+                  "subj": ("Bill Gates", "PERSON", (0, 1)), "obj": ("Microsoft", "ORGANIZATION", (4, 4))}
+
+
+def classifier_attribute(spanbert):
+    """
+    Find the PyTorch module of a SpanBERT object that predict() runs
+    :param spanbert: a SpanBERT object
+    :return: the name of the attribute holding the module
+    """
+    import torch
+    names = [name for name, value in vars(spanbert).items() if isinstance(value, torch.nn.Module)]
+    if len(names) != 1:
+        raise ValueError(f"Expected one PyTorch module in the SpanBERT object, found {len(names)}")
+    return names[0]
+
+
+def quantize_int8(spanbert):
+    """
+    Replace the classifier of a SpanBERT object by a copy whose Linear layers use int8 weights, with activations
+    quantized on the fly; predict() is unchanged
+    :param spanbert: a SpanBERT object
+    :return: void
+    """
+    import torch
+    name = classifier_attribute(spanbert)
+    module = getattr(spanbert, name).to("cpu").eval()
+    setattr(spanbert, name, torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8))
+
+
+class CallRecorder:
+    """
+    Wraps a module and keeps the arguments of its last call
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.args = None
+        self.kwargs = None
+        self.output = None
+
+    def __call__(self, *args, **kwargs):
+        self.args, self.kwargs = args, kwargs
+        self.output = self.module(*args, **kwargs)
+        return self.output
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+
+class OnnxClassifier:
+    """
+    Stands in for the PyTorch classifier of a SpanBERT object: it takes the same tensors and returns the same logits,
+    computed by an ONNX Runtime session
+    """
+
+    def __init__(self, path, returns_tuple=False):
+        """
+        :param path: the exported ONNX model
+        :param returns_tuple: whether the PyTorch module returned its logits in a tuple
+        """
+        import torch
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.returns_tuple = returns_tuple
+
+    def __call__(self, *args, **kwargs):
+        import torch
+        feeds = {name: arg.cpu().numpy() for name, arg in zip(self.input_names, args)}
+        logits = torch.from_numpy(self.session.run(None, feeds)[0])
+        return (logits,) if self.returns_tuple else logits
+
+    def eval(self):
+        return self
+
+    def train(self, mode=True):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def export_onnx(spanbert, path, int8=False):
+    """
+    Export the classifier of a SpanBERT object to ONNX, unless it has been exported already, and make predict() run
+    it with ONNX Runtime
+    :param spanbert: a SpanBERT object
+    :param path: the ONNX file of the fp32 model; the int8 model is written next to it
+    :param int8: whether to run the model with dynamically quantized int8 weights
+    :return: void
+    """
+    import torch
+    if onnxruntime is None:
+        raise ValueError("The onnx SpanBERT backends need ONNX Runtime: pip3 install onnx onnxruntime")
+    name = classifier_attribute(spanbert)
+    module = getattr(spanbert, name).to("cpu").eval()
+    # Record the tensors predict() passes to the classifier; they are the example inputs of the export
+    recorder = CallRecorder(module)
+    setattr(spanbert, name, recorder)
+    spanbert.predict([SAMPLE_EXAMPLE])
+    setattr(spanbert, name, module)
+    if any(value is not None for value in recorder.kwargs.values()):
+        raise ValueError("The SpanBERT classifier is called with keyword tensors, which the ONNX export does not map")
+    returns_tuple = isinstance(recorder.output, (tuple, list))
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    if not os.path.exists(path):
+        input_names = [f"input_{i}" for i in range(len(recorder.args))]
+        dynamic_axes = {input_name: {0: "batch", 1: "sequence"} for input_name in input_names}
+        dynamic_axes["logits"] = {0: "batch"}
+        options = {}
+        # Newer torch versions default to an exporter that writes the weights to a separate file; the TorchScript
+        # exporter keeps the model in one file, which can be written under a temporary name and then moved
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            options["dynamo"] = False
+        tmp = path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(module, tuple(recorder.args), tmp, input_names=input_names, output_names=["logits"],
+                              dynamic_axes=dynamic_axes, opset_version=14, **options)
+        os.replace(tmp, path)
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.splitext(path)[0] + ".int8.onnx"
+        if not os.path.exists(int8_path):
+            tmp = int8_path + ".tmp"
+            quantize_dynamic(path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, int8_path)
+        path = int8_path
+    setattr(spanbert, name, OnnxClassifier(path, returns_tuple))
+
+
+def load_spanbert(spanbert_dir, backend=DEFAULT_BACKEND, onnx_path=DEFAULT_ONNX_PATH):
+    """
+    Load the SpanBERT relation classifier with the given inference backend. Every backend keeps the
+    predict(examples) interface of SpanBERT
+    :param spanbert_dir: the folder of the fine-tuned SpanBERT model
+    :param backend: one of BACKENDS
+    :param onnx_path: the ONNX file of the exported model (onnx backends only)
+    :return: a SpanBERT object
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown SpanBERT backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    spanbert = SpanBERT(spanbert_dir)
+    # Part of the key of memoized predictions, as each backend predicts slightly different confidences
+    spanbert.backend = backend
+    if backend == "int8":
+        quantize_int8(spanbert)
+    elif backend in ("onnx", "onnx-int8"):
+        export_onnx(spanbert, onnx_path, int8=backend == "onnx-int8")
+    return spanbert
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gpt_engine import GPTEngine, TokenBucket
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+class StubOpenAI:
+    """
+    Stand-in for the openai module: Completion.create raises the queued errors first, then answers with the prompt
+    """
+
+    error = types.SimpleNamespace(RateLimitError=RateLimitError, AuthenticationError=AuthenticationError)
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+        self.Completion = self
+
+    def create(self, prompt, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"choices": [{"text": "answer to " + prompt}]}
+
+
+def test_retries_retryable_error():
+    client = StubOpenAI([RateLimitError("slow down"), RateLimitError("slow down")])
+    engine = GPTEngine(client, backoff=0.001)
+    assert engine.complete("prompt") == "answer to prompt"
+    assert client.calls == 3
+    assert engine.retries == 2
+
+
+def test_gives_up_after_max_retries():
+    client = StubOpenAI([RateLimitError("slow down")] * 3)
+    engine = GPTEngine(client, max_retries=2, backoff=0.001)
+    assert engine.complete("prompt") == ""
+    assert client.calls == 3
+
+
+def test_raises_authentication_error_without_retrying():
+    client = StubOpenAI([AuthenticationError("invalid key")])
+    engine = GPTEngine(client, backoff=0.001)
+    with pytest.raises(AuthenticationError):
+        engine.complete("prompt")
+    assert client.calls == 1
+    assert engine.retries == 0
+
+
+def test_memoizes_responses():
+    client = StubOpenAI()
+    engine = GPTEngine(client)
+    assert engine.complete_all(["a", "b", "a"]) == ["answer to a", "answer to b", "answer to a"]
+    assert engine.complete("b") == "answer to b"
+    assert client.calls == 2
+    assert engine.memo_hits == 1
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # The first token is available right away, the 5 others come every 1/50 s
+    assert time.monotonic() - started >= 5 / 50 * 0.9
+
+
+def test_rate_limit_is_off_by_default():
+    engine = GPTEngine(StubOpenAI())
+    assert engine.bucket is None
+    engine = GPTEngine(StubOpenAI(), requests_per_minute=6000, max_workers=1)
+    started = time.monotonic()
+    engine.complete_all(["a", "b", "c"])
+    assert time.monotonic() - started >= 2 / 100 * 0.9
@@ -0,0 +1,115 @@
+import heapq
+
+
+class TupleStore:
+    """
+    The set X of extracted (subj, relation, obj) tuples with their confidence scores. Besides dictionary-style
+    access it keeps a max-heap of the tuples not used as queries yet, ordered by confidence and then by insertion
+    order, so that choosing the next query tuple does not scan the whole set. Entries made stale by a confidence
+    increase or by being used as a query are left in the heap and skipped when they reach the top (lazy
+    invalidation).
+    """
+
+    def __init__(self):
+        # tuple -> confidence score, in insertion order
+        self.confidence = {}
+        # tuple -> insertion number, used to break confidence ties in insertion order
+        self.order = {}
+        # (-confidence, insertion number, tuple) entries of the tuples that may be selected as queries
+        self.heap = []
+        self.used = set()
+
+    def __len__(self):
+        return len(self.confidence)
+
+    def __contains__(self, tup):
+        return tup in self.confidence
+
+    def __getitem__(self, tup):
+        return self.confidence[tup]
+
+    def __iter__(self):
+        return iter(self.confidence)
+
+    def items(self):
+        return self.confidence.items()
+
+    def upsert(self, tup, confidence):
+        """
+        Add a tuple, or raise its confidence if the new score is higher. O(log n)
+        :param tup: a (subj, relation, obj) tuple
+        :param confidence: its confidence score
+        :return: True if the tuple was not in the store yet
+        """
+        is_new = tup not in self.confidence
+        if is_new:
+            self.order[tup] = len(self.order)
+        elif self.confidence[tup] >= confidence:
+            return False
+        self.confidence[tup] = confidence
+        if tup not in self.used:
+            heapq.heappush(self.heap, (-confidence, self.order[tup], tup))
+            if len(self.heap) > 2 * len(self.confidence) + 64:
+                self._compact()
+        return is_new
+
+    def mark_used(self, tup):
+        """
+        Record that a tuple was used as a query, e.g. when restoring a checkpoint; its heap entries become stale
+        :param tup: a (subj, relation, obj) tuple
+        :return: void
+        """
+        self.used.add(tup)
+
+    def _compact(self):
+        """
+        Rebuild the heap without its stale entries
+        :return: void
+        """
+        self.heap = [(-confidence, self.order[tup], tup) for tup, confidence in self.confidence.items()
+                     if tup not in self.used]
+        heapq.heapify(self.heap)
+
+    def next_query_tuple(self):
+        """
+        Pop the tuple with the highest confidence (the earliest inserted among equal scores) that was not used as a
+        query yet, and mark it as used. O(log n) amortized
+        :return: a (subj, relation, obj) tuple, or None if every tuple has been used
+        """
+        while self.heap:
+            negative_confidence, _, tup = heapq.heappop(self.heap)
+            if tup in self.used or self.confidence[tup] != -negative_confidence:
+                continue
+            self.used.add(tup)
+            return tup
+        return None
+
+    def query_candidates(self):
+        """
+        Yield the tuples that successive next_query_tuple() calls would pop, in the same order, without changing the
+        store. The heap is walked through a second heap of positions, so each tuple yielded costs O(log n); the store
+        must not be modified while the generator is in use
+        :return: a generator of (subj, relation, obj) tuples
+        """
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier:
+            (negative_confidence, _, tup), i = heapq.heappop(frontier)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+            if tup in self.used or self.confidence[tup] != -negative_confidence:
+                continue
+            yield tup
+
+    def top(self, k=None):
+        """
+        Yield tuples by decreasing confidence, ties in insertion order, without sorting the whole set: building the
+        heap is O(n) and each tuple yielded costs O(log n)
+        :param k: the maximum number of tuples to yield, or None for all of them
+        :return: a generator of (tup, confidence) pairs
+        """
+        heap = [(-confidence, self.order[tup], tup) for tup, confidence in self.confidence.items()]
+        heapq.heapify(heap)
+        for _ in range(len(heap) if k is None else min(k, len(heap))):
+            negative_confidence, _, tup = heapq.heappop(heap)
+            yield tup, -negative_confidence